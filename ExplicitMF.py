@@ -7,6 +7,7 @@ Created on Sun Jan  6 14:42:44 2019
 from numpy.linalg import solve
 from sklearn.metrics import mean_squared_error
 import numpy as np
+import scipy.sparse as sp
 
 class ExplicitMF():
     def __init__(self, ratings, n_factors=40,
@@ -40,20 +41,20 @@ class ExplicitMF():
             ratings: (2D array) rating matrx.
             _lambda: (float) regularization coefficient. 
         """
+        # the system matrix is the same for every row, so it is factored once and
+        # all right-hand sides are solved in one call
         if type == 'user':
             YTY = fixed_vecs.T.dot(fixed_vecs)
             lambdaI = np.eye(YTY.shape[0]) * _lambda
             
-            for u in range(latent_vectors.shape[0]):
-                latent_vectors[u,:] = solve((YTY + lambdaI),
-                              ratings[u,:].dot(fixed_vecs))
+            latent_vectors[:, :] = solve((YTY + lambdaI),
+                                         ratings.dot(fixed_vecs).T).T
         elif type == 'item':
             XTX = fixed_vecs.T.dot(fixed_vecs)
             lambdaI = np.eye(XTX.shape[0]) * _lambda
             
-            for i in range(latent_vectors.shape[0]):
-                latent_vectors[i,:] = solve((XTX + lambdaI),
-                              ratings[:,i].T.dot(fixed_vecs))
+            latent_vectors[:, :] = solve((XTX + lambdaI),
+                                         ratings.T.dot(fixed_vecs).T).T
                 
         return latent_vectors
     
@@ -66,6 +67,7 @@ class ExplicitMF():
         
     def partial_train(self, n_iter):
         """train model for n_iter iterations."""
+        self._seen = None
         ctr = 1
         while ctr <= n_iter:
             if ctr % 10 == 0 and self._v:
@@ -81,13 +83,56 @@ class ExplicitMF():
             
     def predict(self):
         """Predict ratings"""
-        predictions = np.zeros((self.user_vecs.shape[0],
-                                self.item_vecs.shape[0]))
-        for u in range(self.user_vecs.shape[0]):
-            for i in range(self.item_vecs.shape[0]):
-                predictions[u,i] = self.user_vecs[u,:].dot(self.item_vecs[i, :].T)
+        return self.user_vecs.dot(self.item_vecs.T)
+    
+    def recommend(self, user_ids, k=20, exclude_seen=True, block_size=1000):
+        """
+        Top-k items for each user. The scores are computed for block_size users at a
+        time, so the full user x item prediction matrix is never built.
         
-        return predictions
+        Params:
+            user_ids: (list) row indexes of the users.
+            k: (int) number of items per user.
+            exclude_seen: (bool) Whether or not to leave out the items in the training ratings.
+            block_size: (int) number of users scored at a time.
+        Returns:
+            (2D array) item indexes, one row per user with the best item first.
+        """
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        k = min(k, self.n_items)
+        if exclude_seen and getattr(self, '_seen', None) is None:
+            self._seen = sp.csr_matrix(self.ratings)
+        recommendations = np.empty((len(user_ids), k), dtype=np.int64)
+        for start in range(0, len(user_ids), block_size):
+            users = user_ids[start:start + block_size]
+            scores = self.user_vecs[users].dot(self.item_vecs.T)
+            if exclude_seen:
+                seen = self._seen[users].tocoo()
+                scores[seen.row, seen.col] = -np.inf
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind='stable')
+            recommendations[start:start + len(users)] = np.take_along_axis(top, order, axis=1)
+        return recommendations
+    
+    def _observed(self, actual):
+        """Rows, columns and values of the ratings to evaluate"""
+        actual = sp.coo_matrix(actual)
+        nonzero = actual.data != 0
+        return actual.row[nonzero], actual.col[nonzero], actual.data[nonzero]
+    
+    def factor_mse(self, actual, block_size=1000000):
+        """
+        Mean squared error on the observed entries of actual, computed directly from
+        the factors without building the prediction matrix.
+        """
+        rows, cols, values = self._observed(actual)
+        squared_error = 0.0
+        for start in range(0, len(rows), block_size):
+            end = start + block_size
+            pred = np.einsum('ij,ij->i', self.user_vecs[rows[start:end]],
+                             self.item_vecs[cols[start:end]])
+            squared_error += np.square(pred - values[start:end]).sum()
+        return squared_error / len(rows)
     
     def get_mse(self, pred, actual):
         """Calculate mean squard error between actual ratings and predictions"""
@@ -116,11 +161,70 @@ class ExplicitMF():
             else:
                 self.partial_train(n_iter - iter_diff)
             
-            predictions = self.predict()
-            
-            self.train_mse += [self.get_mse(predictions, self.ratings)]
-            self.test_mse += [self.get_mse(predictions, test)]
+            self.train_mse += [self.factor_mse(self.ratings)]
+            self.test_mse += [self.factor_mse(test)]
             if self._v:
                 print("Train mse: {}".format(str(self.train_mse[-1])))
                 print("Test mse: {}".format(str(self.test_mse[-1])))
-            iter_diff = n_iter
\ No newline at end of file
+            iter_diff = n_iter
+
+
+class ImplicitMF(ExplicitMF):
+    def __init__(self, ratings, n_factors=40,
+                 item_reg=0.0, user_reg=0.0,
+                 alpha=1.0, verbose=True):
+        """
+        Implicit feedback matrix factorization (Hu, Koren and Volinsky, 2008).
+        Every stored entry is a read (preference 1) with confidence 1 + alpha * r,
+        missing entries have preference 0 and confidence 1.
+        
+        Params:
+            ratings: (sparse matrix) user x item matrix with the activeTime of the reads.
+            n_factors: (int) number of latent factors after matrix factorization.
+            iterm_reg: (float) Regularization term for item latent factors.
+            user_reg: (float) Regularization term for user latent factors.
+            alpha: (float) how fast the confidence grows with activeTime.
+            verbose: (bool) Whether or not to print out training progress.
+        """
+        super().__init__(sp.csr_matrix(ratings), n_factors=n_factors,
+                         item_reg=item_reg, user_reg=user_reg,
+                         verbose=verbose)
+        self.alpha = alpha
+        
+    def als_step(self, latent_vectors, fixed_vecs,
+                 ratings, _lambda, type='user'):
+        """
+        Alternating Least Squares with confidence weights. Uses
+        Y^T C_u Y = Y^T Y + Y^T (C_u - I) Y, so each row only touches its own reads.
+        
+        Params:
+            latent_vectors: (2D array) vectors need to be adjusted.
+            fixed_vecs: (2D array) vectors fixed.
+            ratings: (sparse matrix) user x item activeTime matrix.
+            _lambda: (float) regularization coefficient. 
+        """
+        if type == 'item':
+            ratings = ratings.T
+        ratings = sp.csr_matrix(ratings)
+        YTY = fixed_vecs.T.dot(fixed_vecs)
+        lambdaI = np.eye(YTY.shape[0]) * _lambda
+        
+        for u in range(latent_vectors.shape[0]):
+            start, end = ratings.indptr[u], ratings.indptr[u + 1]
+            Y = fixed_vecs[ratings.indices[start:end]]
+            confidence = 1.0 + self.alpha * ratings.data[start:end]
+            A = YTY + (Y.T * (confidence - 1.0)).dot(Y) + lambdaI
+            latent_vectors[u,:] = solve(A, Y.T.dot(confidence))
+                
+        return latent_vectors
+    
+    def get_mse(self, pred, actual):
+        """Calculate mean squard error between the predictions and preference 1 on the reads"""
+        actual = sp.coo_matrix(actual)
+        pred = np.asarray(pred[actual.row, actual.col]).flatten()
+        return mean_squared_error(pred, np.ones(len(pred)))
+    
+    def _observed(self, actual):
+        """Every stored entry is a read, with preference 1"""
+        actual = sp.coo_matrix(actual)
+        return actual.row, actual.col, np.ones(actual.nnz)
@@ -0,0 +1,140 @@
+import numpy as np
+
+def _npz_file_name(file_name):
+    """np.savez adds .npz to names without it, load has to open the same file"""
+    file_name = str(file_name)
+    return file_name if file_name.endswith(".npz") else file_name + ".npz"
+
+class IVFIndex():
+    def __init__(self, n_lists=100, n_probe=8, n_iter=20, seed=0):
+        """
+        Inverted file index for approximate top-k inner product search, e.g. the best
+        items for a user from ExplicitMF item_vecs and user_vecs.
+        The vectors are clustered with k-means, and a query is only scored against the
+        vectors in the n_probe clusters closest to it.
+        Inner products are turned into distances by appending sqrt(M^2 - |x|^2) to every
+        vector, where M is the largest norm when the index is built (Bachrach et al. 2014).
+
+        Params:
+            n_lists: (int) number of clusters.
+            n_probe: (int) number of clusters searched per query.
+            n_iter: (int) number of k-means iterations.
+            seed: (int) seed for the k-means initialization.
+        """
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.seed = seed
+
+    def _augment(self, vectors):
+        """Add the extra dimension, so inner product order becomes distance order"""
+        squared_norms = np.einsum('ij,ij->i', vectors, vectors)
+        extra = np.sqrt(np.maximum(self.max_norm ** 2 - squared_norms, 0.0))
+        return np.hstack([vectors, extra[:, None]])
+
+    def _assign(self, augmented):
+        """Closest centroid of each augmented vector"""
+        distances = (np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :]
+                     - 2.0 * augmented.dot(self.centroids.T))
+        return np.argmin(distances, axis=1)
+
+    def build(self, vectors, ids=None):
+        """
+        Cluster the vectors and build the inverted lists.
+
+        Params:
+            vectors: (2D array) one vector per item.
+            ids: (1D array) id of each vector, the row index if not given.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.max_norm = float(np.sqrt(np.einsum('ij,ij->i', vectors, vectors).max()))
+        augmented = self._augment(vectors)
+        n_lists = min(self.n_lists, len(vectors))
+        rng = np.random.default_rng(self.seed)
+        self.centroids = augmented[rng.choice(len(vectors), size=n_lists, replace=False)].copy()
+        for _ in range(self.n_iter):
+            assignments = self._assign(augmented)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, augmented)
+            counts = np.bincount(assignments, minlength=n_lists)
+            non_empty = counts > 0
+            self.centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        self.vectors = np.empty((0, vectors.shape[1]), dtype=np.float32)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.assignments = np.empty(0, dtype=np.int64)
+        self.add(vectors, ids)
+        return self
+
+    def add(self, vectors, ids=None):
+        """
+        Add new vectors to the closest existing cluster, without clustering again.
+        Vectors longer than the longest vector at build time are searched with a
+        slightly worse recall.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if ids is None:
+            start = self.ids.max() + 1 if len(self.ids) else 0
+            ids = np.arange(start, start + len(vectors))
+        assignments = self._assign(self._augment(vectors))
+        vectors = np.vstack([self.vectors, vectors])
+        ids = np.concatenate([self.ids, np.asarray(ids, dtype=np.int64)])
+        assignments = np.concatenate([self.assignments, assignments])
+        # keep every inverted list contiguous
+        order = np.argsort(assignments, kind='stable')
+        self.vectors = vectors[order]
+        self.ids = ids[order]
+        self.assignments = assignments[order]
+        self.offsets = np.searchsorted(self.assignments, np.arange(len(self.centroids) + 1))
+
+    def search(self, queries, k=20, n_probe=None):
+        """
+        Approximate top-k inner product search.
+
+        Params:
+            queries: (2D array) one query vector per row, e.g. user_vecs[users].
+            k: (int) number of results per query.
+            n_probe: (int) number of clusters searched, self.n_probe if not given.
+        Returns:
+            ids: (2D array) ids of the best vectors, best first, -1 when fewer than k were found.
+            scores: (2D array) inner products of the results.
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        n_probe = min(self.n_probe if n_probe is None else n_probe, len(self.centroids))
+        # the extra query component is 0, so the closest centroid has the highest score
+        centroid_scores = (2.0 * queries.dot(self.centroids[:, :-1].T)
+                           - np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :])
+        probes = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+        result_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        result_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for (q, query) in enumerate(queries):
+            candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probes[q]])
+            if len(candidates) == 0:
+                continue
+            scores = self.vectors[candidates].dot(query)
+            n = min(k, len(candidates))
+            top = np.argpartition(-scores, n - 1)[:n]
+            top = top[np.argsort(-scores[top], kind='stable')]
+            result_ids[q, :n] = self.ids[candidates[top]]
+            result_scores[q, :n] = scores[top]
+        return result_ids, result_scores
+
+    def save(self, file_name):
+        """Save the index to a .npz file, .npz is added to file_name if it is missing"""
+        np.savez(_npz_file_name(file_name), centroids=self.centroids, vectors=self.vectors, ids=self.ids,
+                 assignments=self.assignments,
+                 params=np.array([self.n_lists, self.n_probe, self.n_iter, self.seed]),
+                 max_norm=np.array(self.max_norm))
+
+    @classmethod
+    def load(cls, file_name):
+        """Load an index saved with save, with the same file_name"""
+        data = np.load(_npz_file_name(file_name))
+        (n_lists, n_probe, n_iter, seed) = [int(p) for p in data['params']]
+        index = cls(n_lists=n_lists, n_probe=n_probe, n_iter=n_iter, seed=seed)
+        index.max_norm = float(data['max_norm'])
+        index.centroids = data['centroids']
+        index.vectors = data['vectors']
+        index.ids = data['ids']
+        index.assignments = data['assignments']
+        index.offsets = np.searchsorted(index.assignments, np.arange(len(index.centroids) + 1))
+        return index
@@ -0,0 +1,192 @@
+import bisect
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+
+FORMAT = "graph-recommender-artifact"
+FORMAT_VERSION = 1
+
+class StringTable():
+    """
+        Sorted distinct strings stored as one utf-8 blob and the offsets of every string,
+        so a memory mapped table is used without decoding all strings when it is loaded.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    @classmethod
+    def from_values(cls, values):
+        """The table and the code of every value"""
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object).astype(str).to_numpy(dtype=object), sort=True)
+        encoded = [value.encode("utf-8") for value in uniques]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(e) for e in encoded])
+        blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(blob, offsets), codes
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def find(self, value):
+        """Code of the value, -1 if it is not in the table"""
+        i = bisect.bisect_left(self, value)
+        if i < len(self) and self[i] == value:
+            return i
+        return -1
+
+    def decode(self, codes):
+        return [self[i] for i in codes]
+
+def _write(directory, kind, arrays, tables, metadata):
+    """Write the arrays and string tables with a manifest, replacing directory when it is complete"""
+    tmp = directory.rstrip(os.sep) + ".tmp"
+    if os.path.isdir(tmp):
+        shutil.rmtree(tmp)
+    os.makedirs(tmp)
+    for (name, table) in tables.items():
+        arrays[f"{name}_blob"] = table.blob
+        arrays[f"{name}_offsets"] = table.offsets
+    manifest = {"format": FORMAT, "version": FORMAT_VERSION, "kind": kind, "metadata": metadata,
+                "tables": sorted(tables), "arrays": {}}
+    for (name, array) in arrays.items():
+        array = np.ascontiguousarray(array)
+        np.save(os.path.join(tmp, f"{name}.npy"), array)
+        manifest["arrays"][name] = {"file": f"{name}.npy", "dtype": array.dtype.str, "shape": list(array.shape)}
+    with open(os.path.join(tmp, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    old = directory.rstrip(os.sep) + ".old"
+    if os.path.isdir(directory):
+        os.replace(directory, old)
+    os.replace(tmp, directory)
+    if os.path.isdir(old):
+        shutil.rmtree(old)
+
+def _read(directory, kind, mmap=True):
+    """The manifest, arrays and string tables of an artifact, the arrays memory mapped read-only"""
+    with open(os.path.join(directory, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != FORMAT or manifest.get("kind") != kind:
+        raise ValueError(f"{directory} is not a {kind} artifact")
+    if manifest["version"] > FORMAT_VERSION:
+        raise ValueError(f"{directory} has format version {manifest['version']}, this code reads up to {FORMAT_VERSION}")
+    arrays = {name: np.load(os.path.join(directory, spec["file"]), mmap_mode="r" if mmap else None)
+              for (name, spec) in manifest["arrays"].items()}
+    tables = {name: StringTable(arrays.pop(f"{name}_blob"), arrays.pop(f"{name}_offsets"))
+              for name in manifest["tables"]}
+    return manifest, arrays, tables
+
+class PredictionArtifact():
+    def __init__(self, users, urls, items, metadata=None):
+        """
+        Predictions as an int32 users x k matrix of url codes, best first and padded with -1,
+        and the user and url tables.
+        """
+        self.users = users
+        self.urls = urls
+        self.items = items
+        self.metadata = {} if metadata is None else metadata
+
+    @classmethod
+    def from_df(cls, df, metadata=None):
+        """From userId, url rows with the predictions of each user, best first"""
+        users, user_codes = StringTable.from_values(df["userId"].to_numpy())
+        urls, url_codes = StringTable.from_values(df["url"].to_numpy())
+        rank = pd.Series(user_codes).groupby(user_codes, sort=False).cumcount().to_numpy()
+        k = int(rank.max()) + 1 if len(rank) else 0
+        items = np.full((len(users), k), -1, dtype=np.int32)
+        items[user_codes, rank] = url_codes
+        return cls(users, urls, items, metadata)
+
+    def save(self, directory):
+        _write(directory, "predictions", {"items": self.items}, {"users": self.users, "urls": self.urls}, self.metadata)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        (manifest, arrays, tables) = _read(directory, "predictions", mmap)
+        return cls(tables["users"], tables["urls"], arrays["items"], manifest["metadata"])
+
+    def recommend(self, user, k=None):
+        """Urls predicted for the user, an empty list for unknown users"""
+        u = self.users.find(user)
+        if u < 0:
+            return []
+        codes = self.items[u, :k]
+        return self.urls.decode(codes[codes >= 0])
+
+    def to_df(self):
+        """The userId, url dataframe the artifact was made from"""
+        (rows, ranks) = np.nonzero(np.asarray(self.items) >= 0)
+        return pd.DataFrame({"userId": self.users.decode(rows), "url": self.urls.decode(self.items[rows, ranks])})
+
+class FactorArtifact():
+    def __init__(self, user_vecs, item_vecs, user_ids=None, item_ids=None, metadata=None):
+        """
+        float32 user and item factors of a trained ExplicitMF or ImplicitMF, with the ids of
+        the rows when they are given (e.g. InteractionMatrix.user_ids and item_ids). With
+        ids the rows are in the (sorted) order of the id tables, see user_row and item_row.
+        """
+        self.user_vecs = user_vecs
+        self.item_vecs = item_vecs
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.metadata = {} if metadata is None else metadata
+
+    @classmethod
+    def from_model(cls, model, user_ids=None, item_ids=None):
+        metadata = {"model": type(model).__name__, "n_factors": model.n_factors,
+                    "user_reg": model.user_reg, "item_reg": model.item_reg}
+        if hasattr(model, "alpha"):
+            metadata["alpha"] = model.alpha
+        user_table = item_table = None
+        if user_ids is not None:
+            # the rows are stored in the order of the sorted table
+            user_table, codes = StringTable.from_values(user_ids)
+            user_vecs = np.empty_like(model.user_vecs, dtype=np.float32)
+            user_vecs[codes] = model.user_vecs
+        else:
+            user_vecs = model.user_vecs.astype(np.float32)
+        if item_ids is not None:
+            item_table, codes = StringTable.from_values(item_ids)
+            item_vecs = np.empty_like(model.item_vecs, dtype=np.float32)
+            item_vecs[codes] = model.item_vecs
+        else:
+            item_vecs = model.item_vecs.astype(np.float32)
+        return cls(user_vecs, item_vecs, user_table, item_table, metadata)
+
+    def save(self, directory):
+        tables = {}
+        if self.user_ids is not None:
+            tables["user_ids"] = self.user_ids
+        if self.item_ids is not None:
+            tables["item_ids"] = self.item_ids
+        _write(directory, "factors", {"user_vecs": self.user_vecs, "item_vecs": self.item_vecs}, tables, self.metadata)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        (manifest, arrays, tables) = _read(directory, "factors", mmap)
+        return cls(arrays["user_vecs"], arrays["item_vecs"], tables.get("user_ids"), tables.get("item_ids"),
+                   manifest["metadata"])
+
+    def user_row(self, user_id):
+        return self.user_ids.find(str(user_id))
+
+    def item_row(self, item_id):
+        return self.item_ids.find(str(item_id))
+
+    def recommend(self, users, k=20):
+        """
+            Item rows with the k highest scores for each of the user rows, best first
+            (nothing is excluded, the training ratings are not stored).
+        """
+        scores = np.asarray(self.user_vecs[np.asarray(users)]).dot(np.asarray(self.item_vecs).T)
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+        return np.take_along_axis(top, order, axis=1)
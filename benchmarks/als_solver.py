@@ -0,0 +1,73 @@
+"""
+Compare the batched ALS step in ExplicitMF with the old per-row solve loop.
+
+    python -m benchmarks.als_solver                      # synthetic 1000 x 20000 matrix
+    python -m benchmarks.als_solver --data active1000    # the active1000 rating matrix
+"""
+import argparse
+import time
+import numpy as np
+from numpy.linalg import solve
+import ExplicitMF as mf
+
+
+def looped_als_step(latent_vectors, fixed_vecs, ratings, _lambda, type='user'):
+    """The ALS step as it was before, one solve per user/item."""
+    YTY = fixed_vecs.T.dot(fixed_vecs)
+    lambdaI = np.eye(YTY.shape[0]) * _lambda
+    if type == 'user':
+        for u in range(latent_vectors.shape[0]):
+            latent_vectors[u, :] = solve((YTY + lambdaI), ratings[u, :].dot(fixed_vecs))
+    else:
+        for i in range(latent_vectors.shape[0]):
+            latent_vectors[i, :] = solve((YTY + lambdaI), ratings[:, i].T.dot(fixed_vecs))
+    return latent_vectors
+
+
+def rating_matrix(args):
+    if args.data is not None:
+        from project_example import load_data, load_dataset
+        return load_dataset(load_data(args.data)).toarray()
+    rng = np.random.default_rng(0)
+    return (rng.random((args.users, args.items)) < args.density).astype(np.float64)
+
+
+def time_step(step, model, ratings, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        user_vecs = model.user_vecs.copy()
+        item_vecs = model.item_vecs.copy()
+        start_time = time.perf_counter()
+        user_vecs = step(user_vecs, item_vecs, ratings, 0.1, type='user')
+        item_vecs = step(item_vecs, user_vecs, ratings, 0.1, type='item')
+        best = min(best, time.perf_counter() - start_time)
+    return best, user_vecs, item_vecs
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", help="directory with the active1000 files, synthetic data if not given")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--density", type=float, default=0.02)
+    parser.add_argument("--factors", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    ratings = rating_matrix(args)
+    model = mf.ExplicitMF(ratings, n_factors=args.factors, verbose=False)
+    model.user_vecs = np.random.random((model.n_users, model.n_factors))
+    model.item_vecs = np.random.random((model.n_items, model.n_factors))
+    print("Rating matrix: {} x {}, {} factors".format(model.n_users, model.n_items, args.factors))
+
+    looped, looped_users, looped_items = time_step(looped_als_step, model, ratings, args.repeat)
+    batched, batched_users, batched_items = time_step(model.als_step, model, ratings, args.repeat)
+    print("Per-row solve: {:.3f} s per iteration".format(looped))
+    print("Batched solve: {:.3f} s per iteration".format(batched))
+    print("Speedup: {:.1f}x".format(looped / batched))
+    print("Max difference: {:.2e}".format(max(np.abs(looped_users - batched_users).max(),
+                                              np.abs(looped_items - batched_items).max())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Recall and latency of IVFIndex against exact brute-force top-k.
+
+    python -m benchmarks.ann_recall --items 100000 --lists 300
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import ExplicitMF as mf
+from ann_index import IVFIndex
+
+
+def factors(args):
+    """User and item vectors from ExplicitMF trained on a synthetic clustered rating matrix"""
+    rng = np.random.default_rng(0)
+    topics = rng.integers(0, args.topics, args.items)
+    interests = rng.integers(0, args.topics, (args.users, 3))
+    likes = (topics[None, :] == interests[:, :, None]).any(axis=1)
+    ratings = (rng.random((args.users, args.items)) < np.where(likes, 0.05, 0.002)).astype(np.float64)
+    model = mf.ExplicitMF(ratings, n_factors=args.factors, user_reg=0.1, item_reg=0.1, verbose=False)
+    model.train(args.iterations)
+    return model.user_vecs.astype(np.float32), model.item_vecs.astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--topics", type=int, default=100)
+    parser.add_argument("--factors", type=int, default=40)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--lists", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args()
+
+    user_vecs, item_vecs = factors(args)
+    queries = user_vecs[:args.queries]
+
+    start_time = time.perf_counter()
+    exact = np.argsort(-queries.dot(item_vecs.T), axis=1)[:, :args.k]
+    exact_ms = (time.perf_counter() - start_time) * 1000.0 / len(queries)
+
+    start_time = time.perf_counter()
+    index = IVFIndex(n_lists=args.lists).build(item_vecs)
+    print("Built index over {} items in {:.1f} s".format(len(item_vecs), time.perf_counter() - start_time))
+    print("Brute force: {:.3f} ms/query".format(exact_ms))
+    print("{:>8} {:>10} {:>10}".format("n_probe", "recall@k", "ms/query"))
+    for n_probe in [1, 2, 4, 8, 16, 32, 64]:
+        if n_probe > args.lists:
+            break
+        start_time = time.perf_counter()
+        found, _ = index.search(queries, args.k, n_probe=n_probe)
+        took_ms = (time.perf_counter() - start_time) * 1000.0 / len(queries)
+        recall = np.mean([len(np.intersect1d(f, e)) / args.k for (f, e) in zip(found, exact)])
+        print("{:>8} {:>10.3f} {:>10.3f}".format(n_probe, recall, took_ms))
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_name = os.path.join(directory, "index.npz")
+        index.save(file_name)
+        loaded = IVFIndex.load(file_name)
+        assert np.array_equal(loaded.search(queries[:10], args.k)[0], index.search(queries[:10], args.k)[0])
+
+
+if __name__ == '__main__':
+    main()
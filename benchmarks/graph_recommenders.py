@@ -0,0 +1,142 @@
+"""
+Import, best friend lookup, predictions and cold start of the graph recommenders on a
+synthetic dataset with the fields and shape of the Adressa event files, written as JSON
+so runs can be compared.
+
+    python -m benchmarks.graph_recommenders --backend sparse --users 2000 --events 50000
+    python -m benchmarks.graph_recommenders --backend neo4j --password test --profile-rate 0.1
+
+The neo4j backend imports into the given database, use an empty one.
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import numpy as np
+from recommender_backend import create_backend
+
+CATEGORIES = ["nyheter|trondheim", "nyheter|innenriks", "100sport|fotball", "100sport|vintersport",
+              "pluss|nyheter", "kultur|musikk", "meninger|debatt", "bolig|interior"]
+
+
+def generate_events(path, users, articles, events, days, seed=0):
+    """
+        Write events files in the Adressa format, one file per day. Article popularity and
+        user activity follow a Zipf-like distribution, and a share of the events are front
+        page views and events with missing fields, as in the real files.
+    """
+    rng = np.random.default_rng(seed)
+    user_ids = ["cx:{}:{:013x}".format(rng.bytes(8).hex(), i) for i in range(users)]
+    document_ids = ["{}{:08x}".format(rng.bytes(16).hex(), i) for i in range(articles)]
+    article_categories = rng.integers(0, len(CATEGORIES), articles)
+    start = 1483225200
+    article_published = start + rng.integers(-30 * 86400, days * 86400, articles)
+    user_weights = 1.0 / np.arange(1, users + 1) ** 0.8
+    article_weights = 1.0 / np.arange(1, articles + 1) ** 1.1
+    event_users = rng.choice(users, events, p=user_weights / user_weights.sum())
+    event_articles = rng.choice(articles, events, p=article_weights / article_weights.sum())
+    front_page = rng.random(events) < 0.1
+    no_active_time = rng.random(events) < 0.3
+    times = np.sort(start + rng.integers(0, days * 86400, events))
+    active_times = rng.integers(1, 600, events)
+    files = []
+    per_day = int(np.ceil(events / days))
+    for day in range(days):
+        name = "2017{:04d}".format(101 + day)
+        with open(os.path.join(path, name), "w") as f:
+            for i in range(day * per_day, min((day + 1) * per_day, events)):
+                a = event_articles[i]
+                event = {"eventId": i, "userId": user_ids[event_users[i]], "time": int(times[i]),
+                         "activeTime": None if no_active_time[i] else int(active_times[i])}
+                if front_page[i]:
+                    event.update({"url": "http://adressa.no", "title": None, "category": None,
+                                  "documentId": None, "publishtime": None})
+                else:
+                    event.update({"url": "http://adressa.no/{}/{}.html".format(CATEGORIES[article_categories[a]].replace("|", "/"), document_ids[a][:12]),
+                                  "title": "Article {}".format(a), "category": CATEGORIES[article_categories[a]],
+                                  "documentId": document_ids[a],
+                                  "publishtime": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(article_published[a]))})
+                f.write(json.dumps(event) + "\n")
+        files.append(name)
+    return user_ids, files
+
+
+def timed(results, name, f, *args, calls=1):
+    start_time = time.perf_counter()
+    value = f(*args)
+    took = time.perf_counter() - start_time
+    results[name] = {"seconds": took, "calls": calls, "ms_per_call": 1000.0 * took / calls}
+    print("{:<40} {:>10.3f} s {:>10.3f} ms/call".format(name, took, 1000.0 * took / calls))
+    return value
+
+
+def run(args, path):
+    user_ids, files = generate_events(path, args.users, args.articles, args.events, args.days, args.seed)
+    rng = np.random.default_rng(args.seed)
+    sample = list(rng.choice(user_ids, min(args.sample, len(user_ids)), replace=False))
+    sample = sample + ["cx:unknown:{}".format(i) for i in range(args.sample // 10)]
+    results = {}
+
+    if args.backend == "sparse":
+        engine = timed(results, "import", lambda: create_backend("sparse", path=path, files=files))
+    else:
+        engine = create_backend("neo4j", uri=args.uri, user=args.user, password=args.password, database=args.database)
+        if args.profile_rate > 0 or args.profile:
+            engine.enable_query_profiler(profile_rate=args.profile_rate, seed=args.seed)
+        timed(results, "import", engine.import_data_bulk, path, files)
+        if args.best_friend_index:
+            timed(results, "build_best_friend_index", engine.build_best_friend_index)
+
+    friends = timed(results, "find_best_friends", lambda: [engine.find_best_friends(u) for u in sample], calls=len(sample))
+    timed(results, "find_newest_to_friend", lambda: [engine.find_newest_to_friend(u, f) for (u, f) in zip(sample, friends)], calls=len(sample))
+    timed(results, "predict_on_popularity", engine.predict_on_popularity, sample, calls=len(sample))
+    timed(results, "predict_on_popularity_categories", engine.predict_on_popularity, sample, CATEGORIES[:2], calls=len(sample))
+    timed(results, "predict_on_bestfriends_newest", engine.predict_on_bestfriends_newest, sample, calls=len(sample))
+    if args.backend == "neo4j":
+        timed(results, "predict_on_popularity_batch", engine.predict_on_popularity_batch, sample, calls=len(sample))
+        timed(results, "predict_on_bestfriends_newest_batch", engine.predict_on_bestfriends_newest_batch, sample, calls=len(sample))
+    timed(results, "cold_start", lambda: [engine.cold_start() for _ in range(args.repeat)], calls=args.repeat)
+    timed(results, "cold_start_with_categories", lambda: [engine.cold_start_with_categories(CATEGORIES[:2]) for _ in range(args.repeat)], calls=args.repeat)
+
+    queries = None
+    if getattr(engine, "query_profiler", None) is not None:
+        report = engine.query_profiler.report()
+        print(report.to_string())
+        queries = json.loads(report.to_json(orient="index"))
+    engine.close()
+    return results, queries
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", choices=["sparse", "neo4j"], default="sparse")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--articles", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=50000)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--sample", type=int, default=200, help="number of users to predict for")
+    parser.add_argument("--repeat", type=int, default=20, help="number of cold start calls")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--uri", default="bolt://localhost:7687")
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default="test")
+    parser.add_argument("--database", default=None)
+    parser.add_argument("--best-friend-index", action="store_true")
+    parser.add_argument("--profile", action="store_true", help="record the time and rows per query")
+    parser.add_argument("--profile-rate", type=float, default=0.0, help="share of the queries run with PROFILE")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        results, queries = run(args, path)
+    params = {key: value for (key, value) in vars(args).items() if key != "password"}
+    with open(args.output, "w") as f:
+        json.dump({"backend": args.backend, "params": params, "python": platform.python_version(),
+                   "results": results, "queries": queries}, f, indent=2)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
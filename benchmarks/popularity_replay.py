@@ -0,0 +1,67 @@
+"""
+Ingest rate, top-k latency and number of articles kept by PopularityEngine, replaying
+events files as fast as possible (or --speedup times faster than they happened).
+
+    python -m benchmarks.popularity_replay --data active1000 --days 7
+    python -m benchmarks.popularity_replay --synthetic --events 500000
+"""
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+from popularity_engine import PopularityEngine
+from benchmarks.graph_recommenders import generate_events
+
+
+def replay(args, path, files):
+    engine = PopularityEngine(half_life=args.half_life, window=args.window, buckets=args.buckets,
+                              top_n=args.k, refresh_interval=args.refresh_interval)
+    start_time = time.perf_counter()
+    nr_of_events = engine.replay(path, files, speedup=args.speedup)
+    took = time.perf_counter() - start_time
+    print("Replayed {} events in {:.1f} s: {:.0f} events/s".format(nr_of_events, took, nr_of_events / took))
+    (_, category_lists) = engine.most_popular(args.k)
+    print("Articles in the window: {}, categories: {}".format(len(engine), len(category_lists)))
+
+    latencies = np.empty(args.queries)
+    categories = list(category_lists)[:2]
+    for i in range(args.queries):
+        start_time = time.perf_counter()
+        engine.top(categories if i % 2 else None)
+        latencies[i] = time.perf_counter() - start_time
+    p50, p99 = np.percentile(latencies * 1e6, [50, 99])
+    print("top() latency us: p50 {:.2f}, p99 {:.2f}".format(p50, p99))
+    print("Top {} at the end of the replay:".format(args.k))
+    for url in engine.top():
+        print("  " + url)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default="active1000", help="directory with the events files")
+    parser.add_argument("--days", type=int, default=7, help="number of files to replay")
+    parser.add_argument("--synthetic", action="store_true", help="replay generated events instead of --data")
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--articles", type=int, default=20000)
+    parser.add_argument("--events", type=int, default=500000)
+    parser.add_argument("--speedup", type=float, default=None, help="replay speed, as fast as possible if not given")
+    parser.add_argument("--half-life", type=float, default=3600.0)
+    parser.add_argument("--window", type=int, default=86400)
+    parser.add_argument("--buckets", type=int, default=24)
+    parser.add_argument("--refresh-interval", type=float, default=60)
+    parser.add_argument("--queries", type=int, default=10000)
+    parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        with tempfile.TemporaryDirectory() as path:
+            (_, files) = generate_events(path, args.users, args.articles, args.events, args.days)
+            replay(args, path, files)
+    else:
+        files = sorted(os.listdir(args.data))[:args.days]
+        replay(args, args.data, files)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Latency and throughput of RecommendationService, replaying the users (and categories) of
+an events file as requests, with a fixed number of requests in flight.
+
+    python -m benchmarks.serving_load --events active1000/20170101 --concurrency 1000
+"""
+import argparse
+import asyncio
+import json
+import time
+import numpy as np
+from recommendation_service import RecommendationService
+
+
+def load_requests(file_name, limit):
+    """(userId, categories) of every event in the file, categories is None if unknown"""
+    requests = []
+    for line in open(file_name):
+        event = json.loads(line)
+        if event is None:
+            continue
+        category = event.get("category")
+        requests.append((event["userId"], None if category is None else category.split("|")))
+        if limit is not None and len(requests) == limit:
+            break
+    return requests
+
+
+async def replay(service, requests, concurrency, k):
+    latencies = np.empty(len(requests))
+    position = iter(range(len(requests)))
+
+    async def client():
+        for i in position:
+            (user, categories) = requests[i]
+            start_time = time.perf_counter()
+            await service.recommend(user, categories, k)
+            latencies[i] = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies, time.perf_counter() - start_time
+
+
+async def run(args):
+    requests = load_requests(args.events, args.requests)
+    async with RecommendationService(args.uri, args.user, args.password,
+                                     best_friend_index=args.best_friend_index, timeout=args.timeout,
+                                     max_concurrency=args.max_queries) as service:
+        latencies, took = await replay(service, requests, args.concurrency, args.k)
+        stats = dict(service.stats)
+    p50, p95, p99 = np.percentile(latencies * 1000.0, [50, 95, 99])
+    print("{} requests, {} in flight: {:.0f} requests/s".format(len(requests), args.concurrency, len(requests) / took))
+    print("latency ms: p50 {:.2f}, p95 {:.2f}, p99 {:.2f}".format(p50, p95, p99))
+    print("queries {queries}, coalesced {coalesced}, timeouts {timeouts}, errors {errors}, cold starts {cold_starts}".format(**stats))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", required=True, help="events file, one json event per line")
+    parser.add_argument("--requests", type=int, default=None, help="replay only the first events")
+    parser.add_argument("--uri", default="bolt://localhost:7687")
+    parser.add_argument("--user", default="neo4j")
+    parser.add_argument("--password", default="test")
+    parser.add_argument("--best-friend-index", action="store_true")
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--max-queries", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=0.5)
+    parser.add_argument("-k", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
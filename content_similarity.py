@@ -0,0 +1,60 @@
+import numpy as np
+import scipy.sparse as sp
+
+class NeighborTable():
+    def __init__(self, indptr, indices, scores):
+        """
+        The most similar items of every item, stored as CSR arrays: the neighbors of
+        item i are indices[indptr[i]:indptr[i+1]], most similar first.
+        """
+        self.indptr = indptr
+        self.indices = indices
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def neighbors(self, item, k=None):
+        """Indexes of the (at most k) most similar items"""
+        start, end = self.indptr[item], self.indptr[item + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return self.indices[start:end]
+
+    def similarities(self, item, k=None):
+        start, end = self.indptr[item], self.indptr[item + 1]
+        if k is not None:
+            end = min(end, start + k)
+        return self.scores[start:end]
+
+    def to_csr(self):
+        return sp.csr_matrix((self.scores, self.indices, self.indptr), shape=(len(self), len(self)))
+
+
+def top_k_neighbors(features, k=20, chunk_size=512):
+    """
+    The k most similar rows of every row by inner product, which is the cosine similarity
+    for the L2 normalized rows from TfidfVectorizer. Similarities are computed for
+    chunk_size rows at a time, so memory is chunk_size x items instead of items x items.
+    An item is not its own neighbor, and equal similarities are ordered by index.
+    """
+    features = sp.csr_matrix(features)
+    features_t = features.T.tocsc()
+    n_items = features.shape[0]
+    k = min(k, n_items - 1)
+    indices = np.empty((n_items, k), dtype=np.int32)
+    scores = np.empty((n_items, k), dtype=np.float32)
+    for start in range(0, n_items, chunk_size):
+        end = min(start + chunk_size, n_items)
+        block = (features[start:end] @ features_t).toarray()
+        block[np.arange(end - start), np.arange(start, end)] = -np.inf
+        if k == 0:
+            continue
+        kth = -np.partition(-block, k - 1, axis=1)[:, k - 1]
+        for (row, similarity) in enumerate(block):
+            candidates = np.flatnonzero(similarity >= kth[row])
+            best = candidates[np.lexsort((candidates, -similarity[candidates]))[:k]]
+            indices[start + row] = best
+            scores[start + row] = similarity[best]
+    indptr = np.arange(0, n_items * k + 1, k, dtype=np.int64)
+    return NeighborTable(indptr, indices.ravel(), scores.ravel())
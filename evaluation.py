@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+def evaluate_predictions(df_predictions, df_test, k=20):
+    """
+        All metrics per user, computed with one join of the test reads and the predictions.
+        df_predictions: userId, url rows with the predictions of each user, best first
+                        (as in the .feather prediction files).
+        df_test: userId, url rows with the reads of each user in the test data.
+        Returns a dataframe indexed by userId, for every user in df_test, with
+            hits: test reads of the user on a predicted url (TP)
+            precision, recall, f1: in percent, TP / (TP + FP), TP / (TP + FN)
+            ndcg: NDCG@k over the distinct test urls of the user
+            arhr: ARHR@k, sum of 1/rank of the distinct test urls in the top k
+    """
+    test = df_test[["userId", "url"]].astype(object)
+    predictions = df_predictions[["userId", "url"]].astype(object)
+    predictions = predictions.assign(rank=predictions.groupby("userId", sort=False).cumcount() + 1)
+    nr_of_predictions = predictions.groupby("userId", sort=False).size()
+    first_rank = predictions.drop_duplicates(["userId", "url"])
+
+    joined = test.merge(first_rank, on=["userId", "url"], how="left")
+    joined["hit"] = joined["rank"].notna()
+    metrics = joined.groupby("userId").agg(tests=("url", "size"), hits=("hit", "sum"))
+    metrics["predictions"] = nr_of_predictions.reindex(metrics.index, fill_value=0)
+
+    metrics["precision"] = 100 * metrics["hits"] / metrics["predictions"].where(metrics["predictions"] > 0)
+    metrics["precision"] = metrics["precision"].fillna(0.0)
+    metrics["recall"] = 100 * metrics["hits"] / metrics["tests"]
+    pr = metrics["precision"] + metrics["recall"]
+    metrics["f1"] = (2 * metrics["precision"] * metrics["recall"] / pr.where(pr > 0)).fillna(0.0)
+
+    distinct = joined.drop_duplicates(["userId", "url"])
+    relevant = distinct.groupby("userId").size()
+    top = distinct[distinct["rank"] <= k]
+    discounts = 1.0 / np.log2(np.arange(2, k + 2))
+    dcg = (1.0 / np.log2(top["rank"] + 1)).groupby(top["userId"]).sum()
+    ideal = np.r_[0.0, np.cumsum(discounts)][np.minimum(relevant.to_numpy(), k)]
+    metrics["ndcg"] = dcg.reindex(metrics.index, fill_value=0.0) / pd.Series(ideal, index=relevant.index)
+    metrics["arhr"] = (1.0 / top["rank"]).groupby(top["userId"]).sum().reindex(metrics.index, fill_value=0.0)
+    return metrics
+
+def click_through_rate(metrics, nr_of_recommendations):
+    """Percent of the recommendations that were read, from the evaluate_predictions metrics"""
+    return 100 * metrics["hits"].sum() / (len(metrics) * nr_of_recommendations)
+
+def hit_rate_at_k(pred, actual, k):
+    """
+        Recall@k and ARHR@k when there is one actual item per prediction list,
+        pred is a list of ranked item lists and actual the item that was read next.
+    """
+    ranked = np.full((len(pred), k), -1, dtype=np.int64)
+    for (i, p) in enumerate(pred):
+        ranked[i, :len(p[:k])] = p[:k]
+    hits = ranked == np.asarray(actual, dtype=np.int64)[:, None]
+    found = hits.any(axis=1)
+    rank = hits.argmax(axis=1) + 1
+    recall = found.sum() / float(len(actual))
+    arhr = (found / rank).sum() / float(len(actual))
+    return recall, arhr
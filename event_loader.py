@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+
+# string ids that are stored as integer codes while loading
+ID_COLUMNS = ["userId", "documentId", "url"]
+COLUMN_TYPES = {"eventId": np.int64, "time": np.int64, "activeTime": np.float64}
+
+class IdEncoder():
+    """Gives every distinct id an integer code, in order of first appearance"""
+
+    def __init__(self):
+        self.index = {}
+        self.values = []
+
+    def encode(self, values):
+        """Codes of the values, -1 for None"""
+        codes = np.empty(len(values), dtype=np.int32)
+        index = self.index
+        for (i, value) in enumerate(values):
+            if value is None:
+                codes[i] = -1
+                continue
+            code = index.get(value)
+            if code is None:
+                code = index[value] = len(self.values)
+                self.values.append(value)
+            codes[i] = code
+        return codes
+
+def _to_array(values, dtype):
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        # missing values
+        return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+def _to_frame(columns, encoders):
+    data = {}
+    for (key, values) in columns.items():
+        if key in ID_COLUMNS:
+            data[key] = encoders.setdefault(key, IdEncoder()).encode(values)
+        elif key in COLUMN_TYPES:
+            data[key] = _to_array(values, COLUMN_TYPES[key])
+        else:
+            data[key] = np.array(values, dtype=object)
+    return pd.DataFrame(data)
+
+def iter_event_chunks(path, files, usecols=None, chunk_size=100000, encoders=None):
+    """
+        Read the events in the files, and yield them as dataframes of chunk_size events.
+        The columns in ID_COLUMNS are integer codes (-1 for null), the ids are in
+        encoders[column].values. Only the usecols columns are kept, all columns if None.
+    """
+    encoders = {} if encoders is None else encoders
+    columns = {} if usecols is None else {key: [] for key in usecols}
+    n = 0
+    for f in files:
+        file_name = os.path.join(path, f)
+        if not os.path.isfile(file_name):
+            continue
+        logging.info(f"Loading file: {file_name}")
+        for line in open(file_name):
+            event = json.loads(line.strip())
+            if event is None:
+                continue
+            if usecols is None:
+                for key in event:
+                    if key not in columns:
+                        columns[key] = [None] * n
+            for (key, values) in columns.items():
+                values.append(event.get(key))
+            n = n + 1
+            if n == chunk_size:
+                yield _to_frame(columns, encoders)
+                columns = {key: [] for key in columns}
+                n = 0
+    if n > 0:
+        yield _to_frame(columns, encoders)
+
+def _load_events(path, files, usecols, chunk_size):
+    encoders = {}
+    chunks = list(iter_event_chunks(path, files, usecols, chunk_size, encoders))
+    if not chunks:
+        return pd.DataFrame(columns=usecols)
+    df = pd.concat(chunks, ignore_index=True)
+    for key in ID_COLUMNS:
+        if key in df:
+            df[key] = pd.Categorical.from_codes(df[key].to_numpy(), categories=encoders[key].values)
+    return df
+
+def _cache_file(path, files, usecols, cache_dir):
+    sources = []
+    for f in files:
+        file_name = os.path.join(path, f)
+        if os.path.isfile(file_name):
+            stat = os.stat(file_name)
+            sources.append([os.path.abspath(file_name), stat.st_size, stat.st_mtime_ns])
+    key = hashlib.sha1(json.dumps([sources, usecols]).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"events_{key}.feather")
+
+def load_events(path, files, usecols=None, cache_dir=None, chunk_size=100000, categorical=True):
+    """
+        Load events from files to a dataframe, without building a list of all events first.
+        userId, documentId and url are categorical columns, or plain strings with
+        categorical=False. With cache_dir the dataframe is also written as an uncompressed
+        Feather file, which is memory mapped instead of parsing the files on later runs.
+    """
+    if cache_dir is None:
+        df = _load_events(path, files, usecols, chunk_size)
+    else:
+        cache_file = _cache_file(path, files, usecols, cache_dir)
+        if os.path.isfile(cache_file):
+            logging.info(f"Loading cached events: {cache_file}")
+            df = feather.read_table(cache_file, memory_map=True).to_pandas()
+        else:
+            df = _load_events(path, files, usecols, chunk_size)
+            os.makedirs(cache_dir, exist_ok=True)
+            df.to_feather(cache_file + ".tmp", compression="uncompressed")
+            os.replace(cache_file + ".tmp", cache_file)
+    if not categorical:
+        for key in ID_COLUMNS:
+            if key in df:
+                df[key] = df[key].astype(object)
+    return df
@@ -1,84 +1,421 @@
 from neo4j import GraphDatabase
+from recommender_backend import RecommenderBackend
+from popularity_cache import PopularityCache
+from recommendation_cache import RecommendationCache, COLD_START
+from query_profiler import QueryProfiler
+from event_loader import load_events
 import json
 from types import SimpleNamespace
 import os
 import time
 import pandas as pd
 import logging
+import queue
+import threading
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 logging.basicConfig(filename='info.log', level=logging.INFO)
 
-class GraphRecommendationSystem:
+SCHEMA = [
+    "CREATE CONSTRAINT user_id IF NOT EXISTS FOR (u:User) REQUIRE u.id IS UNIQUE",
+    "CREATE CONSTRAINT category_name IF NOT EXISTS FOR (c:Category) REQUIRE c.name IS UNIQUE",
+    "CREATE INDEX article_document_id IF NOT EXISTS FOR (a:Article) ON (a.documentId)",
+    "CREATE INDEX article_url IF NOT EXISTS FOR (a:Article) ON (a.url)",
+    "CREATE INDEX read_event_id IF NOT EXISTS FOR ()-[r:read]-() ON (r.eventId)",
+]
 
-    def __init__(self, uri, user, password):
-        self.driver = GraphDatabase.driver(uri, auth=(user, password))
+# best friends of u, as a list in the variable friends
+FRIENDS_SUBQUERY = (" call {"
+                    "   with u"
+                    "   match (u)-[:read]->(:Article)<-[:read]-(f:User)"
+                    "   with f, count(*) as c"
+                    "   order by c desc"
+                    "   limit 10"
+                    "   return collect(f) as friends"
+                    " }")
+INDEXED_FRIENDS_SUBQUERY = (" call {"
+                            "   with u"
+                            "   match (u)-[s:SIMILAR_TO]->(f:User)"
+                            "   with f, s.weight as c"
+                            "   order by c desc"
+                            "   limit 10"
+                            "   return collect(f) as friends"
+                            " }")
+
+MOST_POPULAR_QUERY = (" match (u1)-[r1:read]->(recommendation)"
+                      " return distinct recommendation.url as url, r1.activeTime as activeTime"
+                      " order by activeTime desc"
+                      " limit $limit")
+MOST_POPULAR_PER_CATEGORY_QUERY = (" match (u1)-[r1:read]->(recommendation)-[rc:has_category]->(c:Category)"
+                                   " with distinct c.name as category, recommendation.url as url, r1.activeTime as activeTime"
+                                   " order by activeTime desc"
+                                   " with category, collect([url, activeTime])[..$limit] as top"
+                                   " return category, top")
+
+def predict_batch_on_popularity_query(friends_subquery):
+    """
+        Popularity predictions for the users in $userIds, at most $limit urls each.
+        Returns userId, exists and urls per user.
+    """
+    return (" unwind $userIds as userId"
+            " optional match (u:User {id: userId})"
+            + friends_subquery +
+            " call {"
+            "   with u, friends"
+            "   unwind friends as f"
+            "   match (f)-[r:read]->(recommendation:Article)"
+            "   where not (u)-[:read]->(recommendation)"
+            "   with distinct recommendation.url as url, r.activeTime as activeTime"
+            "   order by activeTime desc"
+            "   limit $limit"
+            "   return collect(url) as urls"
+            " }"
+            " return userId, u is not null as exists, urls, [f in friends | f.id] as friendIds")
+
+def parse_publishtime(publishtime):
+    if publishtime is None:
+        publishtime = "1970-01-01T00:00:00.000Z"
+    return int(time.mktime(time.strptime(publishtime, '%Y-%m-%dT%H:%M:%S.%fZ')))
+
+def normalize_event(event):
+    """
+        Apply the import defaults to a raw event dict. Returns None for front page
+        events without a title, which are not imported.
+    """
+    if event["title"] is None and event["url"] == "http://adressa.no":
+        return None
+    return {
+        "userId": event["userId"],
+        "eventId": event["eventId"],
+        "time": event["time"],
+        "activeTime": -1 if event["activeTime"] is None else event["activeTime"],
+        "title": "Unknown" if event["title"] is None else event["title"],
+        "url": event["url"],
+        "publishTime": parse_publishtime(event["publishtime"]),
+        "documentId": "Unknown" if event["documentId"] is None else event["documentId"],
+    }
+
+def parse_event_file(file_name, sort_events=False):
+    """
+        Read and normalize one events file. Returns the normalized events and the
+        [documentId, category] pairs to import. With sort_events the events are
+        ordered by (time, eventId).
+    """
+    events = []
+    categories = []
+    for line in open(file_name):
+        event = json.loads(line)
+        if event is None:
+            continue
+        if event["category"] is not None and event["documentId"] is not None:
+            categories.append([event["documentId"], event["category"]])
+        event = normalize_event(event)
+        if event is not None:
+            events.append(event)
+    if sort_events:
+        events.sort(key=lambda e: (e["time"], e["eventId"]))
+    return events, categories
+
+def _category_params(categories):
+    pairs = dict.fromkeys((documentId, name) for (documentId, categoriesString) in categories
+                          for name in categoriesString.split("|"))
+    return [{"documentId": documentId, "name": name} for (documentId, name) in pairs]
+
+def _predictions_to_df(predictions):
+    p = []
+    for prediction in predictions:
+        for pp in prediction[1]:
+            p.append([prediction[0], pp])
+    return pd.DataFrame(p, columns=["userId", "url"])
+
+def _chunks(items, chunk_size):
+    for i in range(0, len(items), chunk_size):
+        yield items[i:i + chunk_size]
+
+class GraphRecommendationSystem(RecommenderBackend):
+
+    def __init__(self, uri, user, password, best_friend_index=False,
+                 max_connection_pool_size=100, fetch_size=1000, database=None):
+        """
+            best_friend_index: (bool) Whether the SIMILAR_TO relationships are already built
+                               (see build_best_friend_index) and should be used.
+            max_connection_pool_size: (int) Maximum number of connections kept by the driver.
+            fetch_size: (int) Number of records fetched per batch from the server.
+            database: (str) Database to use, the server default if None.
+            Use a neo4j:// uri on a cluster to route the read transactions to the replicas.
+        """
+        self.driver = GraphDatabase.driver(uri, auth=(user, password),
+                                           max_connection_pool_size=max_connection_pool_size)
+        self.fetch_size = fetch_size
+        self.database = database
+        self.best_friend_index = best_friend_index
+        self.popularity_cache = None
+        self.recommendation_cache = None
+        self.query_profiler = None
+        self._local = threading.local()
+        self._sessions = []
+        self._sessions_lock = threading.Lock()
 
     def close(self):
+        with self._sessions_lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
         self.driver.close()
 
+    def _session(self):
+        """Long-lived session of the calling thread, sessions can not be shared between threads"""
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self.driver.session(fetch_size=self.fetch_size, database=self.database)
+            self._local.session = session
+            with self._sessions_lock:
+                self._sessions.append(session)
+        return session
+
+    def _read(self, work, *args):
+        return self._session().execute_read(self._profiled(work), *args)
+
+    def _write(self, work, *args):
+        return self._session().execute_write(self._profiled(work), *args)
+
+    def enable_query_profiler(self, sample_rate=1.0, profile_rate=0.0, seed=None):
+        """
+            Record the time, rows and (for profile_rate of them) the PROFILE db hits of the
+            queries, see QueryProfiler. db.query_profiler.report() returns the totals per query.
+        """
+        self.query_profiler = QueryProfiler(sample_rate, profile_rate, seed)
+        return self.query_profiler
+
+    def _profiled(self, work):
+        if self.query_profiler is None:
+            return work
+        return self.query_profiler.wrap(work)
+
+    def ensure_schema(self):
+        """
+            Create the constraints and indexes used by the import and recommendation queries,
+            does nothing for the ones that already exist. Article.documentId is not unique,
+            the same document can be stored with different titles and urls.
+        """
+        session = self._session()
+        for statement in SCHEMA:
+            session.run(statement).consume()
+        session.run("CALL db.awaitIndexes()").consume()
+
     def insert_events(self, events):
-        with self.driver.session() as session:
-            for event in events:
-                session.write_transaction(self._create_event, event)
+        for event in events:
+            self._write(self._create_event, event)
+        self._after_insert([e.userId for e in events], [e.url for e in events])
+
+    def insert_events_bulk(self, events, categories, chunk_size=5000):
+        """
+            Insert normalized events (see normalize_event) in chunks, one write transaction
+            per chunk. Users, articles and categories are deduplicated before they are sent,
+            so a chunk costs a few UNWIND statements instead of one transaction per event.
+        """
+        for chunk in _chunks(events, chunk_size):
+            self._write(self._create_events_bulk, chunk)
+        for chunk in _chunks(_category_params(categories), chunk_size):
+            self._write(self._create_categories_bulk, chunk)
+        self._after_insert([e["userId"] for e in events], [e["url"] for e in events])
 
     def insert_categories(self, categories):
-        with self.driver.session() as session:
-            for (documentId, categoriesString) in categories:
-                session.write_transaction(self._create_categories, documentId, categoriesString)
+        for (documentId, categoriesString) in categories:
+            self._write(self._create_categories, documentId, categoriesString)
+        if self.popularity_cache is not None:
+            self.popularity_cache.invalidate()
+        if self.recommendation_cache is not None:
+            self.recommendation_cache.invalidate([COLD_START])
 
     def _predict_for_user_on_popularity(self, user, friends):
-        with self.driver.session() as session:
-            result = session.write_transaction(self.__predict_for_user_on_popularity, user, friends)
-            return result
+        return self._read(self.__predict_for_user_on_popularity, user, friends)
+
+    def enable_popularity_cache(self, ttl=3600, top_n=10):
+        """
+            Serve cold_start and cold_start_with_categories from in-memory top_n lists, which
+            are loaded again after ttl seconds and after every import.
+        """
+        self.popularity_cache = PopularityCache(self._load_popularity, ttl, top_n)
+
+    def enable_recommendation_cache(self, max_size=10000, ttl=300):
+        """
+            Keep the predictions of the max_size most recently predicted users for ttl seconds.
+            The inserts drop the predictions of the users that read something new and of the
+            users that have one of them as best friend, see RecommendationCache.
+        """
+        self.recommendation_cache = RecommendationCache(max_size, ttl)
+
+    def _cached(self, user, strategy, categories=None):
+        if self.recommendation_cache is None:
+            return None
+        return self.recommendation_cache.get(user, strategy, categories)
+
+    def _cache(self, user, strategy, categories, urls, depends_on):
+        if self.recommendation_cache is not None:
+            self.recommendation_cache.put(user, strategy, categories, urls, depends_on)
+
+    def _load_popularity(self, top_n):
+        return self._read(self._most_popular, top_n)
 
     def cold_start(self):
-        with self.driver.session() as session:
-            result = session.write_transaction(self.__cold_start_on_popularity)
-            return result
+        if self.popularity_cache is not None:
+            return self.popularity_cache.top()
+        return self._read(self.__cold_start_on_popularity)
     
     def cold_start_with_categories(self, categories):
-        with self.driver.session() as session:
-            result = session.write_transaction(self.__cold_start_with_categories_on_popularity, categories)
-            return result
+        if self.popularity_cache is not None:
+            return self.popularity_cache.top(categories)
+        return self._read(self.__cold_start_with_categories_on_popularity, categories)
     
     def user_exists(self, user):
-        with self.driver.session() as session:
-            result = session.write_transaction(self._user_exists, user)
-            return result
+        return self._read(self._user_exists, user)
     
     def find_best_friends(self, user):
-        with self.driver.session() as session:
-            result = session.write_transaction(self._find_best_friends, user)
-            return result
+        if self.best_friend_index:
+            return self._read(self._find_indexed_best_friends, user)
+        return self._read(self._find_best_friends, user)
+
+    def _friends_subquery(self):
+        return INDEXED_FRIENDS_SUBQUERY if self.best_friend_index else FRIENDS_SUBQUERY
+
+    def build_best_friend_index(self, batch_size=500):
+        """
+            Store the best friends of every user as SIMILAR_TO relationships, with the number
+            of co-read articles as weight. After this find_best_friends is a 1-hop lookup, and
+            the inserts keep the relationships of the affected users up to date.
+        """
+        start_time = time.time()
+        users = self._read(self._all_users)
+        self.best_friend_index = True
+        self._refresh_best_friends(users, batch_size)
+        logging.info(f"Building best friend index for {len(users)} users took: {((time.time() - start_time)/60.0)} minutes")
+
+    def _refresh_best_friends(self, users, batch_size=500):
+        for batch in _chunks(list(users), batch_size):
+            self._write(self._create_best_friends, batch)
+
+    def _after_insert(self, users, urls):
+        """Bring the derived data up to date after new reads of users on urls."""
+        affected = self._update_best_friend_index(users, urls)
+        if self.popularity_cache is not None:
+            self.popularity_cache.invalidate()
+        if self.recommendation_cache is not None:
+            # the friends of the affected users are new, the other entries only change through reads of users they depend on
+            self.recommendation_cache.invalidate(set(users) | affected | {COLD_START})
+
+    def _update_best_friend_index(self, users, urls, batch_size=500):
+        """
+            New reads change the co-read counts of the readers and of everyone else that has
+            read the same articles, only those users are refreshed.
+        """
+        if not self.best_friend_index:
+            return set()
+        affected = set(users)
+        for batch in _chunks(list(set(urls)), batch_size):
+            affected.update(self._read(self._find_readers, batch))
+        self._refresh_best_friends(affected, batch_size)
+        logging.info(f"Updated best friends of {len(affected)} users")
+        return affected
     
     def find_newest_to_friend(self, user, friend):
-        with self.driver.session() as session:
-            result = session.write_transaction(self._find_newest_to_friend, user, friend)
-            return result
+        return self._read(self._find_newest_to_friend, user, friend)
 
 
     @staticmethod
     def _create_event(tx, event):
-        if event.title is None and event.url == "http://adressa.no":
+        e = normalize_event(vars(event))
+        if e is None:
             return
-        if event.title is None:
-            event.title = "Unknown"
-        if event.activeTime is None: 
-            event.activeTime = -1
-        if event.publishtime is None:
-            event.publishtime = "1970-01-01T00:00:00.000Z"
-        if event.documentId is None:
-            event.documentId = "Unknown"
 
         result = tx.run("Merge (u:User {id: $userId}) "
                         "Merge (a:Article {title: $title, url: $url, publishtime: $publishTime, documentId: $documentId}) "
                         "Merge (u)-[r:read {activeTime: $activeTime, eventId: $eventId, time: $time}]->(a) "
-                        "RETURN id(a) as articleId", userId=event.userId, activeTime=event.activeTime, eventId=event.eventId, time=event.time, title=event.title, url=event.url, publishTime=int(time.mktime(time.strptime(event.publishtime, '%Y-%m-%dT%H:%M:%S.%fZ'))), documentId=event.documentId)
+                        "RETURN id(a) as articleId", userId=e["userId"], activeTime=e["activeTime"], eventId=e["eventId"], time=e["time"], title=e["title"], url=e["url"], publishTime=e["publishTime"], documentId=e["documentId"])
         return result.single()[0]
-    
+
+    @staticmethod
+    def _create_events_bulk(tx, events):
+        GraphRecommendationSystem._create_nodes_bulk(tx, events)
+        GraphRecommendationSystem._create_reads_bulk(tx, events)
+
+    @staticmethod
+    def _create_nodes_bulk(tx, events):
+        """Merge the users and articles of the events, deduplicated"""
+        users = list(dict.fromkeys(e["userId"] for e in events))
+        articles = list({(e["title"], e["url"], e["publishTime"], e["documentId"]):
+                         {"title": e["title"], "url": e["url"], "publishTime": e["publishTime"], "documentId": e["documentId"]}
+                         for e in events}.values())
+        tx.run("UNWIND $users AS userId "
+               "Merge (u:User {id: userId})", users=users)
+        tx.run("UNWIND $articles AS article "
+               "Merge (a:Article {title: article.title, url: article.url, publishtime: article.publishTime, documentId: article.documentId})",
+               articles=articles)
+
+    @staticmethod
+    def _create_reads_bulk(tx, events):
+        """The read relationships of the events, the users and articles must exist"""
+        tx.run("UNWIND $events AS event "
+               "Match (u:User {id: event.userId}) "
+               "Match (a:Article {title: event.title, url: event.url, publishtime: event.publishTime, documentId: event.documentId}) "
+               "Merge (u)-[r:read {activeTime: event.activeTime, eventId: event.eventId, time: event.time}]->(a)",
+               events=events)
+
+    @staticmethod
+    def _merge_events_bulk(tx, events):
+        """
+            Idempotent version of _create_events_bulk. Events whose eventId is already
+            imported are skipped, articles are merged on documentId (and url for unknown
+            documents) and their other properties set afterwards. Returns the new events.
+        """
+        eventIds = [e["eventId"] for e in events]
+        result = tx.run("UNWIND $eventIds AS eventId "
+                        "Match ()-[r:read {eventId: eventId}]->() "
+                        "RETURN distinct r.eventId as eventId", eventIds=eventIds)
+        known = {record["eventId"] for record in result}
+        events = [e for e in events if e["eventId"] not in known]
+        if not events:
+            return events
+        users = list(dict.fromkeys(e["userId"] for e in events))
+        # the last event of a document decides its properties
+        articles = list({(e["documentId"], e["url"] if e["documentId"] == "Unknown" else None):
+                         {"title": e["title"], "url": e["url"], "publishTime": e["publishTime"], "documentId": e["documentId"]}
+                         for e in events}.values())
+        tx.run("UNWIND $users AS userId "
+               "Merge (u:User {id: userId})", users=users)
+        tx.run("UNWIND $articles AS article "
+               "Merge (a:Article {documentId: article.documentId}) "
+               "Set a.title = article.title, a.url = article.url, a.publishtime = article.publishTime",
+               articles=[a for a in articles if a["documentId"] != "Unknown"])
+        tx.run("UNWIND $articles AS article "
+               "Merge (a:Article {documentId: article.documentId, url: article.url}) "
+               "Set a.title = article.title, a.publishtime = article.publishTime",
+               articles=[a for a in articles if a["documentId"] == "Unknown"])
+        tx.run("UNWIND $events AS event "
+               "Match (u:User {id: event.userId}) "
+               "Match (a:Article {documentId: event.documentId}) "
+               "Merge (u)-[r:read {eventId: event.eventId}]->(a) "
+               "Set r.activeTime = event.activeTime, r.time = event.time",
+               events=[e for e in events if e["documentId"] != "Unknown"])
+        tx.run("UNWIND $events AS event "
+               "Match (u:User {id: event.userId}) "
+               "Match (a:Article {url: event.url, documentId: event.documentId}) "
+               "Merge (u)-[r:read {eventId: event.eventId}]->(a) "
+               "Set r.activeTime = event.activeTime, r.time = event.time",
+               events=[e for e in events if e["documentId"] == "Unknown"])
+        return events
+
+    @staticmethod
+    def _create_categories_bulk(tx, categories):
+        tx.run("UNWIND $categories AS category "
+               "Match (a:Article) where a.documentId = category.documentId "
+               "Merge (c:Category {name: category.name}) "
+               "Merge (a)-[r:has_category]->(c)", categories=categories)
+
     @staticmethod
     def _create_categories(tx, documentId, categoriesString):
         categories = categoriesString.split("|")
-        query = "Match (a) where a.documentId= $documentId "
+        query = "Match (a:Article) where a.documentId= $documentId "
         for category in categories:
             tx.run(query + " Merge (c:Category {name: $name}) "
                         "Merge (a)-[r:has_category]->(c) "
@@ -111,6 +448,13 @@ class GraphRecommendationSystem:
                         " limit 10")
         return [record["url"] for record in result]
     
+    @staticmethod
+    def _most_popular(tx, limit):
+        result = tx.run(MOST_POPULAR_QUERY, limit=limit)
+        top = [(record["url"], record["activeTime"]) for record in result]
+        result = tx.run(MOST_POPULAR_PER_CATEGORY_QUERY, limit=limit)
+        return top, {record["category"]: record["top"] for record in result}
+
     @staticmethod
     def __cold_start_with_categories_on_popularity(tx, categories):
         result = tx.run(
@@ -129,9 +473,13 @@ class GraphRecommendationSystem:
         for user in users:
             logging.info("--------------------------------------")
             start_time = time.time()
-            if self.user_exists(user):
+            cached = self._cached(user, "popularity", categories)
+            if cached is not None:
+                predictions.append([user, cached])
+            elif self.user_exists(user):
                 friends = self.find_best_friends(user)
                 p = self._predict_for_user_on_popularity(user, friends)
+                self._cache(user, "popularity", categories, p, friends)
                 predictions.append([user, p])
             else:
                 logging.info(f"User: {user}, does not exist, running cold start") # In a real case, the user will exist, but it will only have been reading the front-page, this simulate the same behavior
@@ -140,18 +488,12 @@ class GraphRecommendationSystem:
                 else:
                     logging.info(f"With categories: {categories}")
                     colds = self.cold_start_with_categories(categories)
-
+                self._cache(user, "popularity", categories, colds, [COLD_START])
                 predictions.append([user, colds])
             nr = nr + 1
             took_m = ((time.time() - start_time)/60.0)
             logging.info(f"User took: {took_m} minutes, {nr}/{nr_of_users}, estimated time left: {((nr_of_users - nr)*took_m)} minutes")
-        p = []
-        for prediction in predictions:
-            for pp in prediction[1]:
-                p.append([prediction[0], pp])
-        predictions_df = pd.DataFrame(p)
-        predictions_df.columns = ["userId", "url"]
-        return predictions_df
+        return _predictions_to_df(predictions)
     
     @staticmethod
     def _find_best_friends(tx, user):
@@ -162,6 +504,47 @@ class GraphRecommendationSystem:
                         " limit 10", userId=user)
         return [record["friend"] for record in result]
     
+    @staticmethod
+    def _find_indexed_best_friends(tx, user):
+        result = tx.run(
+                        " match (u:User {id: $userId})-[s:SIMILAR_TO]->(f:User)"
+                        " return f.id as friend, s.weight as c"
+                        " order by c desc"
+                        " limit 10", userId=user)
+        return [record["friend"] for record in result]
+
+    @staticmethod
+    def _all_users(tx):
+        result = tx.run("match (u:User) return u.id as id")
+        return [record["id"] for record in result]
+
+    @staticmethod
+    def _find_readers(tx, urls):
+        result = tx.run(
+                        " unwind $urls as url"
+                        " match (a:Article {url: url})<-[:read]-(f:User)"
+                        " return distinct f.id as id", urls=urls)
+        return [record["id"] for record in result]
+
+    @staticmethod
+    def _create_best_friends(tx, users):
+        tx.run(
+               " unwind $userIds as userId"
+               " match (u:User {id: userId})"
+               " optional match (u)-[old:SIMILAR_TO]->()"
+               " delete old"
+               " with distinct u"
+               " call {"
+               "   with u"
+               "   match (u)-[:read]->(:Article)<-[:read]-(f:User)"
+               "   with f, count(*) as c"
+               "   order by c desc"
+               "   limit 10"
+               "   return f, c"
+               " }"
+               " merge (u)-[s:SIMILAR_TO]->(f)"
+               " set s.weight = c", userIds=users)
+
     @staticmethod
     def _find_newest_to_friend(tx, user, friends):
         result = tx.run(
@@ -180,20 +563,93 @@ class GraphRecommendationSystem:
         for user in users:
             logging.info("--------------------------------------")
             start_time = time.time()
-            friends = self.find_best_friends(user)
-            predictions.append([user, self.find_newest_to_friend(user, friends)])
+            p = self._cached(user, "bestfriends_newest")
+            if p is None:
+                friends = self.find_best_friends(user)
+                p = self.find_newest_to_friend(user, friends)
+                self._cache(user, "bestfriends_newest", None, p, friends)
+            predictions.append([user, p])
             took_m = ((time.time() - start_time)/60.0)
             logging.info(f"User took: {took_m} minutes, {nr}/{nr_of_users}, estimated time left: {((nr_of_users - nr)*took_m)} minutes")
             nr = nr + 1
-        p = []
-        for prediction in predictions:
-            for pp in prediction[1]:
-                p.append([prediction[0], pp])
-        predictions_df = pd.DataFrame(p)
-        predictions_df.columns = ["userId", "url"]
-        return predictions_df
+        return _predictions_to_df(predictions)
+
+    @staticmethod
+    def _predict_batch_on_popularity(tx, users, friends_subquery):
+        result = tx.run(predict_batch_on_popularity_query(friends_subquery), userIds=users, limit=20)
+        return [(record["userId"], record["exists"], record["urls"], record["friendIds"]) for record in result]
+
+    @staticmethod
+    def _predict_batch_on_bestfriends_newest(tx, users, friends_subquery):
+        result = tx.run(
+                        " unwind $userIds as userId"
+                        " optional match (u:User {id: userId})"
+                        + friends_subquery +
+                        " call {"
+                        "   with u, friends"
+                        "   unwind friends as f"
+                        "   match (f)-[r:read]->(recommendation:Article)"
+                        "   where not (u)-[:read]->(recommendation)"
+                        "   with recommendation"
+                        "   order by recommendation.publishtime desc"
+                        "   limit 20"
+                        "   return collect(recommendation.url) as urls"
+                        " }"
+                        " return userId, urls, [f in friends | f.id] as friendIds", userIds=users)
+        return [(record["userId"], record["urls"], record["friendIds"]) for record in result]
+
+    def predict_on_popularity_batch(self, users, categories=None, batch_size=500):
+        """
+            Same predictions as predict_on_popularity, but batch_size users are scored in one
+            read query. Users that do not exist get the cold start recommendations.
+        """
+        predictions = []
+        colds = None
+        nr_of_users = len(users)
+        nr = 0
+        for batch in _chunks(users, batch_size):
+            start_time = time.time()
+            found = {user: self._cached(user, "popularity", categories) for user in batch}
+            missing = [user for (user, urls) in found.items() if urls is None]
+            for (user, exists, urls, friends) in self._read(self._predict_batch_on_popularity, missing, self._friends_subquery()) if missing else []:
+                if exists:
+                    self._cache(user, "popularity", categories, urls, friends)
+                else:
+                    logging.info(f"User: {user}, does not exist, running cold start")
+                    if colds is None:
+                        colds = self.cold_start() if categories is None else self.cold_start_with_categories(categories)
+                    urls = colds
+                    self._cache(user, "popularity", categories, urls, [COLD_START])
+                found[user] = urls
+            predictions.extend([user, found[user]] for user in batch)
+            nr = nr + len(batch)
+            took_m = ((time.time() - start_time)/60.0)
+            logging.info(f"Batch took: {took_m} minutes, {nr}/{nr_of_users}, estimated time left: {((nr_of_users - nr)/len(batch)*took_m)} minutes")
+        return _predictions_to_df(predictions)
+
+    def predict_on_bestfriends_newest_batch(self, users, batch_size=500):
+        """
+            Same predictions as predict_on_bestfriends_newest, but batch_size users are scored
+            in one read query.
+        """
+        predictions = []
+        nr_of_users = len(users)
+        nr = 0
+        for batch in _chunks(users, batch_size):
+            start_time = time.time()
+            found = {user: self._cached(user, "bestfriends_newest") for user in batch}
+            missing = [user for (user, urls) in found.items() if urls is None]
+            for (user, urls, friends) in self._read(self._predict_batch_on_bestfriends_newest, missing, self._friends_subquery()) if missing else []:
+                self._cache(user, "bestfriends_newest", None, urls, friends)
+                found[user] = urls
+            predictions.extend([user, found[user]] for user in batch)
+            nr = nr + len(batch)
+            took_m = ((time.time() - start_time)/60.0)
+            logging.info(f"Batch took: {took_m} minutes, {nr}/{nr_of_users}, estimated time left: {((nr_of_users - nr)/len(batch)*took_m)} minutes")
+        return _predictions_to_df(predictions)
 
     def import_data(self, path, files):
+        self.ensure_schema()
         nrOfFiles = len(files)
         nr = 0
         logging.info(f"Starting import, nr of files: {nrOfFiles}")
@@ -215,6 +671,238 @@ class GraphRecommendationSystem:
                 self.insert_categories(categories)
                 logging.info(f"File took: {((time.time() - start_time)/60.0)} minutes")
     
+    def import_data_bulk(self, path, files, chunk_size=5000):
+        """
+            Same as import_data, but writes each file through insert_events_bulk.
+            chunk_size is the number of events per write transaction.
+        """
+        self.ensure_schema()
+        nrOfFiles = len(files)
+        nr = 0
+        nr_of_events = 0
+        total_start_time = time.time()
+        logging.info(f"Starting bulk import, nr of files: {nrOfFiles}, chunk size: {chunk_size}")
+        for f in files:
+            file_name=os.path.join(path,f)
+            nr = nr + 1
+            if os.path.isfile(file_name):
+                start_time = time.time()
+                logging.info(f"Filename: {file_name}, nr: {nr}/{nrOfFiles}")
+                events, categories = parse_event_file(file_name)
+                self.insert_events_bulk(events, categories, chunk_size)
+                took = time.time() - start_time
+                nr_of_events = nr_of_events + len(events)
+                logging.info(f"File took: {(took/60.0)} minutes, {len(events)} events, {len(events)/max(took, 1e-9):.0f} events/sec")
+        took = time.time() - total_start_time
+        logging.info(f"Bulk import took: {(took/60.0)} minutes, {nr_of_events} events, {nr_of_events/max(took, 1e-9):.0f} events/sec")
+        return nr_of_events / max(took, 1e-9)
+
+    def import_data_incremental(self, path, files, checkpoint_file="import_checkpoint.json", chunk_size=5000):
+        """
+            Resumable import. The position in each file is stored in checkpoint_file after
+            every chunk, so a run that is stopped continues where it left off, and a new day
+            of data can be imported by calling it again with the new file added to files.
+            Events that are already imported (by eventId) are skipped, so importing a chunk
+            twice is harmless. Articles are stored once per documentId, use it on a database
+            that is imported this way only. Returns the number of new events.
+        """
+        self.ensure_schema()
+        checkpoint = {}
+        if os.path.isfile(checkpoint_file):
+            with open(checkpoint_file) as f:
+                checkpoint = json.load(f)
+        nrOfFiles = len(files)
+        nr = 0
+        nr_of_events = 0
+        total_start_time = time.time()
+        logging.info(f"Starting incremental import, nr of files: {nrOfFiles}, checkpoint: {checkpoint_file}")
+        for f in files:
+            file_name = os.path.join(path, f)
+            nr = nr + 1
+            if not os.path.isfile(file_name):
+                continue
+            offset = checkpoint.get(f, 0)
+            if offset >= os.path.getsize(file_name):
+                logging.info(f"Filename: {file_name}, nr: {nr}/{nrOfFiles}, already imported")
+                continue
+            start_time = time.time()
+            logging.info(f"Filename: {file_name}, nr: {nr}/{nrOfFiles}, starting at byte {offset}")
+            new_events = 0
+            with open(file_name, "rb") as event_file:
+                event_file.seek(offset)
+                while True:
+                    lines = list(itertools.islice(iter(event_file.readline, b""), chunk_size))
+                    if not lines:
+                        break
+                    events = []
+                    categories = []
+                    for line in lines:
+                        event = json.loads(line)
+                        if event is None:
+                            continue
+                        if event["category"] is not None and event["documentId"] is not None:
+                            categories.append([event["documentId"], event["category"]])
+                        event = normalize_event(event)
+                        if event is not None:
+                            events.append(event)
+                    events = self._write(self._merge_events_bulk, events) if events else []
+                    for chunk in _chunks(_category_params(categories), chunk_size):
+                        self._write(self._create_categories_bulk, chunk)
+                    self._after_insert([e["userId"] for e in events], [e["url"] for e in events])
+                    new_events = new_events + len(events)
+                    checkpoint[f] = event_file.tell()
+                    self._save_checkpoint(checkpoint, checkpoint_file)
+            nr_of_events = nr_of_events + new_events
+            logging.info(f"File took: {((time.time() - start_time)/60.0)} minutes, {new_events} new events")
+        logging.info(f"Incremental import took: {((time.time() - total_start_time)/60.0)} minutes, {nr_of_events} new events")
+        return nr_of_events
+
+    @staticmethod
+    def _save_checkpoint(checkpoint, checkpoint_file):
+        with open(checkpoint_file + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(checkpoint_file + ".tmp", checkpoint_file)
+
+    def import_data_parallel(self, path, files, parse_workers=None, write_workers=4, chunk_size=5000, queue_size=16, deterministic=False):
+        """
+            Pipelined import: a process pool parses and normalizes the files while a pool of
+            writer threads, each with its own session, writes chunks to the database. The queue
+            between them holds at most queue_size chunks, so parsing waits for slow writers.
+            With deterministic the files and events are written in sorted order by a single
+            writer, so re-imports produce the same graph.
+            Article has no uniqueness constraint, so concurrent MERGEs could create the same
+            article twice. The users and articles of a file are therefore merged in one
+            transaction before its chunks are queued, and the writers only create reads.
+        """
+        self.ensure_schema()
+        file_names = [os.path.join(path, f) for f in files]
+        file_names = [f for f in file_names if os.path.isfile(f)]
+        if deterministic:
+            file_names.sort()
+            write_workers = 1
+        nrOfFiles = len(file_names)
+        logging.info(f"Starting parallel import, nr of files: {nrOfFiles}, writers: {write_workers}, chunk size: {chunk_size}")
+        chunks = queue.Queue(maxsize=queue_size)
+        errors = []
+        nr_of_events = [0]
+        lock = threading.Lock()
+
+        def write():
+            with self.driver.session(fetch_size=self.fetch_size, database=self.database) as session:
+                while True:
+                    chunk = chunks.get()
+                    try:
+                        if chunk is None:
+                            return
+                        if errors:
+                            continue
+                        (kind, items) = chunk
+                        if kind == "events":
+                            session.execute_write(self._profiled(self._create_reads_bulk), items)
+                            with lock:
+                                nr_of_events[0] += len(items)
+                        else:
+                            session.execute_write(self._profiled(self._create_categories_bulk), items)
+                    except Exception as e:
+                        logging.exception("Writer failed")
+                        errors.append(e)
+                    finally:
+                        chunks.task_done()
+
+        start_time = time.time()
+        writers = [threading.Thread(target=write, daemon=True) for _ in range(write_workers)]
+        for writer in writers:
+            writer.start()
+        categories = []
+        new_users = set()
+        new_urls = set()
+        try:
+            with ProcessPoolExecutor(max_workers=parse_workers) as executor:
+                # at most two parsed files per worker are held in memory
+                max_pending = 2 * (parse_workers or os.cpu_count() or 1)
+                remaining = iter(file_names)
+                pending = []
+                nr = 0
+                while True:
+                    for f in itertools.islice(remaining, max_pending - len(pending)):
+                        pending.append(executor.submit(parse_event_file, f, deterministic))
+                    if not pending:
+                        break
+                    if deterministic:
+                        future = pending.pop(0)
+                    else:
+                        future = next(iter(wait(pending, return_when=FIRST_COMPLETED).done))
+                        pending.remove(future)
+                    (events, file_categories) = future.result()
+                    nr = nr + 1
+                    logging.info(f"Parsed file nr: {nr}/{nrOfFiles}, {len(events)} events")
+                    if errors:
+                        break
+                    self._write(self._create_nodes_bulk, events)
+                    for chunk in _chunks(events, chunk_size):
+                        if errors:
+                            break
+                        chunks.put(("events", chunk))
+                    categories.extend(file_categories)
+                    # for the best friend index and the recommendation cache
+                    new_users.update(e["userId"] for e in events)
+                    new_urls.update(e["url"] for e in events)
+            # categories match on existing articles, so they are written after all events
+            chunks.join()
+            for chunk in _chunks(_category_params(categories), chunk_size):
+                if errors:
+                    break
+                chunks.put(("categories", chunk))
+        finally:
+            for _ in writers:
+                chunks.put(None)
+            for writer in writers:
+                writer.join()
+        if errors:
+            raise errors[0]
+        self._after_insert(new_users, new_urls)
+        took = time.time() - start_time
+        logging.info(f"Parallel import took: {(took/60.0)} minutes, {nr_of_events[0]} events, {nr_of_events[0]/max(took, 1e-9):.0f} events/sec")
+        return nr_of_events[0] / max(took, 1e-9)
+
+    def query_latency_report(self, users, categories=None):
+        """
+            Time each recommendation query for the given users, returns a dataframe with the
+            latency in milliseconds per query.
+        """
+        timings = {}
+
+        def timed(name, f, *args):
+            start_time = time.perf_counter()
+            result = f(*args)
+            timings.setdefault(name, []).append((time.perf_counter() - start_time) * 1000.0)
+            return result
+
+        for user in users:
+            timed("user_exists", self.user_exists, user)
+            friends = timed("find_best_friends", self.find_best_friends, user)
+            timed("predict_for_user_on_popularity", self._predict_for_user_on_popularity, user, friends)
+            timed("find_newest_to_friend", self.find_newest_to_friend, user, friends)
+        timed("cold_start", self.cold_start)
+        if categories is not None:
+            timed("cold_start_with_categories", self.cold_start_with_categories, categories)
+        report = pd.DataFrame([[name, len(t), sum(t)/len(t), sorted(t)[len(t)//2], max(t)] for (name, t) in timings.items()],
+                              columns=["query", "calls", "mean_ms", "median_ms", "max_ms"])
+        return report.set_index("query")
+
+    def schema_latency_report(self, users, categories=None):
+        """
+            Run query_latency_report before and after ensure_schema, to show what the
+            constraints and indexes changed.
+        """
+        before = self.query_latency_report(users, categories)
+        self.ensure_schema()
+        after = self.query_latency_report(users, categories)
+        report = before[["mean_ms"]].join(after[["mean_ms"]], lsuffix="_before", rsuffix="_after")
+        report["speedup"] = report["mean_ms_before"] / report["mean_ms_after"]
+        logging.info(f"Query latency before/after schema:\n{report}")
+        return report
+
     def get_file_paths(self, root_directory: str, test_factor: float):
         all_files = os.listdir(root_directory)
         all_files.sort()
@@ -226,21 +914,12 @@ class GraphRecommendationSystem:
         logging.info(f"Split dataset - files, train: {train}, test: {test}")
         return (all_files[:train], all_files[train:])
 
-def load_data(path, files):
-    map_lst=[]
-    nrOfFiles = len(files)
-    nr = 0
-    logging.info(f"Starting import, nr of files: {nrOfFiles}")
-    for f in files:
-        file_name=os.path.join(path,f)
-        nr = nr + 1
-        logging.info(f"Filename: {file_name}, nr: {nr}/{nrOfFiles}")
-        if os.path.isfile(file_name):
-            for line in open(file_name):
-                obj = json.loads(line.strip())
-                if not obj is None:
-                    map_lst.append(obj)
-    return pd.DataFrame(map_lst) 
+def load_data(path, files, usecols=None, cache_dir=None):
+    """
+        Load events from files to a dataframe, see event_loader.load_events.
+    """
+    logging.info(f"Starting import, nr of files: {len(files)}")
+    return load_events(path, files, usecols=usecols, cache_dir=cache_dir, categorical=False)
 
 if __name__ == "__main__":
     logging.info("Please use the notebook 'graph_base_db'")
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+class InteractionMatrix():
+    def __init__(self, weight=None):
+        """
+        Sparse user x item interaction matrix built from events, which can be extended
+        with new events (e.g. a new day-file) without numbering the old ones again.
+
+        Params:
+            weight: (str) column summed as the value of a user-item pair, e.g. 'activeTime'
+                    (missing values count as 0). Every read pair is 1.0 if None.
+        """
+        self.weight = weight
+        self.user_ids = []
+        self.item_ids = []
+        self.user_index = {}
+        self.item_index = {}
+        self._rows = []
+        self._cols = []
+        self._data = []
+        self._matrix = None
+
+    @classmethod
+    def from_events(cls, df, weight=None):
+        matrix = cls(weight)
+        matrix.append(df)
+        return matrix
+
+    @property
+    def shape(self):
+        return (len(self.user_ids), len(self.item_ids))
+
+    @staticmethod
+    def _indexes(values, ids, index, sort):
+        """Global indexes of the values, unseen ids are numbered after the known ones"""
+        codes, uniques = pd.factorize(values, sort=sort)
+        for value in uniques:
+            if value not in index:
+                index[value] = len(ids)
+                ids.append(value)
+        mapping = np.array([index[value] for value in uniques], dtype=np.int64)
+        return mapping[codes]
+
+    def append(self, df):
+        """
+        Add the reads in df. New users are numbered in sorted userId order and new items
+        in order of first read, as in load_dataset.
+        """
+        df = df[~df['documentId'].isnull()]
+        df = df.sort_values(by=['userId', 'time'])
+        rows = self._indexes(df['userId'].values, self.user_ids, self.user_index, sort=True)
+        cols = self._indexes(df['documentId'].values, self.item_ids, self.item_index, sort=False)
+        if self.weight is None:
+            data = np.ones(len(rows))
+        else:
+            data = df[self.weight].fillna(0).values.astype(np.float64)
+        self._rows.append(rows)
+        self._cols.append(cols)
+        self._data.append(data)
+        return self
+
+    def to_csr(self):
+        """
+        The interactions as a scipy.sparse CSR matrix. After append only the new events are
+        converted, and added to the matrix built before.
+        """
+        if self._matrix is None or self._rows:
+            rows = np.concatenate(self._rows) if self._rows else np.empty(0, dtype=np.int64)
+            cols = np.concatenate(self._cols) if self._cols else np.empty(0, dtype=np.int64)
+            data = np.concatenate(self._data) if self._data else np.empty(0)
+            # duplicate pairs are summed
+            matrix = sp.csr_matrix((data, (rows, cols)), shape=self.shape)
+            if self._matrix is not None:
+                matrix = matrix + self._grown(self._matrix)
+            if self.weight is None:
+                matrix.data[:] = 1.0
+            self._rows, self._cols, self._data = [], [], []
+            self._matrix = matrix
+        return self._matrix
+
+    def _grown(self, matrix):
+        """The matrix with empty rows and columns for the new users and items, without copying it"""
+        (n_users, n_items) = self.shape
+        indptr = np.concatenate([matrix.indptr, np.full(n_users - matrix.shape[0], matrix.indptr[-1], dtype=matrix.indptr.dtype)])
+        return sp.csr_matrix((matrix.data, matrix.indices, indptr), shape=(n_users, n_items), copy=False)
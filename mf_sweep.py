@@ -0,0 +1,140 @@
+import hashlib
+import itertools
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import ExplicitMF as mf
+
+MODELS = {"explicit": mf.ExplicitMF, "implicit": mf.ImplicitMF}
+
+# rating matrices of a worker process, attached to the shared memory of the parent
+_matrices = {}
+_blocks = []
+
+def _share(matrices):
+    """Copy the CSR arrays of the matrices to shared memory, returns the blocks and their description"""
+    blocks = []
+    specs = {}
+    for (name, matrix) in matrices.items():
+        matrix = sp.csr_matrix(matrix)
+        arrays = {}
+        for (field, array) in [("data", matrix.data), ("indices", matrix.indices), ("indptr", matrix.indptr)]:
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            blocks.append(block)
+            arrays[field] = (block.name, array.shape, array.dtype.str)
+        specs[name] = (arrays, matrix.shape)
+    return blocks, specs
+
+def _attach(specs):
+    """Process pool initializer, the matrices are used in place without copying them"""
+    for (name, (arrays, shape)) in specs.items():
+        views = {}
+        for (field, (block_name, array_shape, dtype)) in arrays.items():
+            block = shared_memory.SharedMemory(name=block_name)
+            _blocks.append(block)
+            views[field] = np.ndarray(array_shape, dtype=dtype, buffer=block.buf)
+        _matrices[name] = sp.csr_matrix((views["data"], views["indices"], views["indptr"]), shape=shape, copy=False)
+
+def _data_key(matrices):
+    """Hash of the matrices, so checkpoints of another train/test split are not loaded"""
+    digest = hashlib.sha1()
+    for matrix in matrices:
+        matrix = sp.csr_matrix(matrix)
+        digest.update(repr(matrix.shape).encode("utf-8"))
+        for array in (matrix.data, matrix.indices, matrix.indptr):
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()[:16]
+
+def _checkpoint_file(checkpoint_dir, config, n_iter):
+    name = "{model}_f{n_factors}_reg{reg:g}_alpha{alpha:g}_seed{seed}_data{data_key}".format(**config)
+    return os.path.join(checkpoint_dir, f"{name}_it{n_iter}.npz")
+
+def _learning_curve(config):
+    """
+        Train one configuration, recording the train and test mse after each number of
+        iterations in config["iter_array"]. Saved checkpoints are loaded instead of trained
+        again, and training continues from the last one.
+    """
+    train = _matrices["train"]
+    test = _matrices["test"]
+    kwargs = {"alpha": config["alpha"]} if config["model"] == "implicit" else {}
+    model = MODELS[config["model"]](train, n_factors=config["n_factors"], user_reg=config["reg"],
+                                    item_reg=config["reg"], verbose=False, **kwargs)
+    checkpoint_dir = config["checkpoint_dir"]
+    np.random.seed(config["seed"])
+    rows = []
+    trained = 0
+    for n_iter in sorted(config["iter_array"]):
+        start_time = time.time()
+        checkpoint_file = None if checkpoint_dir is None else _checkpoint_file(checkpoint_dir, config, n_iter)
+        if checkpoint_file is not None and os.path.isfile(checkpoint_file):
+            with np.load(checkpoint_file) as checkpoint:
+                model.user_vecs = checkpoint["user_vecs"]
+                model.item_vecs = checkpoint["item_vecs"]
+                (train_mse, test_mse, seconds) = checkpoint["curve"]
+            resumed = True
+        else:
+            if trained == 0:
+                model.train(n_iter)
+            else:
+                model.partial_train(n_iter - trained)
+            train_mse = model.factor_mse(train)
+            test_mse = model.factor_mse(test)
+            seconds = time.time() - start_time
+            resumed = False
+            if checkpoint_file is not None:
+                np.savez(checkpoint_file + ".tmp.npz", user_vecs=model.user_vecs, item_vecs=model.item_vecs,
+                         curve=np.array([train_mse, test_mse, seconds]))
+                os.replace(checkpoint_file + ".tmp.npz", checkpoint_file)
+        trained = n_iter
+        rows.append({"model": config["model"], "n_factors": config["n_factors"], "reg": config["reg"],
+                     "alpha": config["alpha"], "seed": config["seed"], "data_key": config["data_key"], "iterations": n_iter,
+                     "train_mse": train_mse, "test_mse": test_mse, "seconds": seconds, "resumed": resumed})
+    return rows
+
+def sweep(train, test, n_factors=(10, 20, 40, 80), regs=(0.0, 0.01, 0.1, 1.0),
+          iter_array=(1, 2, 5, 10, 25, 50, 100), model="explicit", alpha=1.0, seed=0,
+          workers=None, checkpoint_dir=None, results_file="mf_sweep.csv"):
+    """
+        Learning curves of ExplicitMF (or ImplicitMF with model="implicit") for every
+        combination of n_factors and regs (used for both user_reg and item_reg), trained in
+        parallel by a pool of worker processes. The train and test matrices are put in
+        shared memory once instead of being sent to every task.
+        With checkpoint_dir the factors are saved after each number of iterations in
+        iter_array, so a stopped sweep continues where it left off, and a sweep with more
+        iterations starts from the saved factors. The checkpoints are only used with the
+        same train and test matrices, a new split trains from scratch.
+        All curves are written to results_file (csv), and returned as a dataframe with
+        one row per configuration and number of iterations. Nothing is plotted.
+    """
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    data_key = _data_key([train, test])
+    configs = [{"model": model, "n_factors": f, "reg": reg, "alpha": alpha, "seed": seed, "data_key": data_key,
+                "iter_array": list(iter_array), "checkpoint_dir": checkpoint_dir}
+               for (f, reg) in itertools.product(n_factors, regs)]
+    (blocks, specs) = _share({"train": train, "test": test})
+    rows = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach, initargs=(specs,)) as executor:
+            futures = {executor.submit(_learning_curve, config): config for config in configs}
+            for (nr, future) in enumerate(as_completed(futures), start=1):
+                config = futures[future]
+                curve = future.result()
+                rows.extend(curve)
+                logging.info(f"Sweep {nr}/{len(configs)}: n_factors {config['n_factors']}, reg {config['reg']}, "
+                             f"test mse {curve[-1]['test_mse']}")
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    results = pd.DataFrame(rows).sort_values(["n_factors", "reg", "iterations"], ignore_index=True)
+    if results_file is not None:
+        results.to_csv(results_file, index=False)
+    return results
@@ -0,0 +1,69 @@
+import heapq
+import threading
+import time
+
+class PopularityCache:
+    """
+        The most popular articles, globally and per category, kept in memory so cold start
+        recommendations do not scan the whole graph.
+        load(top_n) must return the global top_n list and a dict with the top_n list per
+        category, as (url, activeTime) pairs with the highest activeTime first. The lists are
+        loaded again when they are older than ttl seconds or after invalidate().
+    """
+
+    def __init__(self, load, ttl=3600, top_n=10):
+        self._load = load
+        self.ttl = ttl
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loaded_at = None
+        self._global = []
+        self._categories = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def refresh(self):
+        (top, categories) = self._load(self.top_n)
+        self.update(top, categories)
+
+    def update(self, top, categories):
+        """Replace the lists, for callers that load them themselves"""
+        with self._lock:
+            self._global = [tuple(pair) for pair in top]
+            self._categories = {name: [tuple(pair) for pair in pairs] for (name, pairs) in categories.items()}
+            self._loaded_at = time.monotonic()
+
+    def _expired(self):
+        loaded_at = self._loaded_at
+        return loaded_at is None or (self.ttl is not None and time.monotonic() - loaded_at > self.ttl)
+
+    def _ensure_loaded(self):
+        if self._expired():
+            with self._refresh_lock:
+                if self._expired():
+                    self.refresh()
+
+    def top(self, categories=None, n=None):
+        """
+            Urls of the n most popular articles. With categories the per category lists are
+            merged, which gives the same result as ranking the union of the categories.
+        """
+        n = self.top_n if n is None else min(n, self.top_n)
+        self._ensure_loaded()
+        if categories is None:
+            with self._lock:
+                return [url for (url, _) in self._global[:n]]
+        with self._lock:
+            lists = [self._categories.get(name, []) for name in dict.fromkeys(categories)]
+        urls = []
+        seen = set()
+        for pair in heapq.merge(*lists, key=lambda pair: -pair[1]):
+            if pair not in seen:
+                seen.add(pair)
+                urls.append(pair[0])
+                if len(urls) == n:
+                    break
+        return urls
@@ -0,0 +1,212 @@
+import heapq
+import json
+import logging
+import math
+import os
+import time
+from collections import deque
+
+class PopularityEngine():
+    def __init__(self, half_life=3600.0, window=86400, buckets=24, top_n=20, weight=None, refresh_interval=60):
+        """
+        Streaming article popularity. Every read adds weight * 2^((time - t0) / half_life) to
+        the score of the article and of its categories (forward exponential decay), so the
+        scores of the other articles do not have to be updated when time passes, and their
+        order stays the same. Reads older than window seconds are removed again: the window
+        is split in buckets, and the reads of a bucket are subtracted when it leaves the
+        window, so only the articles read in the window are kept in memory.
+        The top_n lists are cached, and built again at most every refresh_interval seconds
+        of event time, so top() does not depend on the number of articles.
+
+        Params:
+            half_life: (float) seconds after which a read counts half.
+            window: (int) seconds of reads that are kept.
+            buckets: (int) number of buckets the window is split in.
+            top_n: (int) length of the cached lists, the most top() returns.
+            weight: (str) event field used as weight of a read, e.g. 'activeTime' (missing
+                    values count as 0). Every read counts 1 if None.
+            refresh_interval: (float) seconds of event time between rebuilds of the lists,
+                              0 to build them again after every change.
+        """
+        self.decay = math.log(2.0) / half_life
+        self.window = window
+        self.bucket_seconds = window / buckets
+        self.n_buckets = buckets
+        self.top_n = top_n
+        self.weight = weight
+        self.refresh_interval = refresh_interval
+        self.now = None
+        self._t0 = None
+        # (bucket number, {url: weight added in the bucket})
+        self._buckets = deque()
+        self._scores = {}
+        self._category_scores = {}
+        self._article_categories = {}
+        # number of buckets with reads of the url
+        self._bucket_counts = {}
+        self._top = []
+        self._category_top = {}
+        self._built_at = None
+        self._dirty = False
+
+    def __len__(self):
+        """Number of articles read in the window"""
+        return len(self._scores)
+
+    def add(self, event):
+        """
+            Add one event, a dict with the fields of the events files. Front page events
+            without a title are skipped, as in the import.
+        """
+        if event is None or (event.get("title") is None and event.get("url") == "http://adressa.no"):
+            return
+        t = event["time"]
+        if self.now is None or t > self.now:
+            self._advance(t)
+        bucket = math.floor(t / self.bucket_seconds)
+        if bucket <= math.floor(self.now / self.bucket_seconds) - self.n_buckets:
+            # older than the window
+            return
+        if self.weight is None:
+            weight = 1.0
+        else:
+            weight = event.get(self.weight) or 0.0
+        url = event["url"]
+        categories = self._article_categories.get(url)
+        if categories is None:
+            category = event.get("category")
+            categories = self._article_categories[url] = () if category is None else tuple(category.split("|"))
+        score = weight * math.exp(self.decay * (t - self._t0))
+        contributions = self._bucket(bucket)
+        if url not in contributions:
+            contributions[url] = 0.0
+            self._bucket_counts[url] = self._bucket_counts.get(url, 0) + 1
+        contributions[url] += score
+        self._scores[url] = self._scores.get(url, 0.0) + score
+        for category in categories:
+            scores = self._category_scores.setdefault(category, {})
+            scores[url] = scores.get(url, 0.0) + score
+        self._dirty = True
+
+    def _bucket(self, bucket):
+        """The contributions of the bucket, buckets can arrive out of order within the window"""
+        for (number, contributions) in reversed(self._buckets):
+            if number == bucket:
+                return contributions
+            if number < bucket:
+                break
+        contributions = {}
+        self._buckets.append((bucket, contributions))
+        if len(self._buckets) > 1 and self._buckets[-2][0] > bucket:
+            self._buckets = deque(sorted(self._buckets, key=lambda b: b[0]))
+        return contributions
+
+    def _advance(self, t):
+        self.now = t
+        if self._t0 is None:
+            self._t0 = t
+        elif self.decay * (t - self._t0) > 500.0:
+            self._rebase(t)
+        last = math.floor(t / self.bucket_seconds) - self.n_buckets
+        while self._buckets and self._buckets[0][0] <= last:
+            self._expire(self._buckets.popleft()[1])
+
+    def _rebase(self, t):
+        """Move the reference time, so the scores of new reads do not overflow"""
+        factor = math.exp(-self.decay * (t - self._t0))
+        self._t0 = t
+        for scores in [self._scores] + list(self._category_scores.values()):
+            for url in scores:
+                scores[url] *= factor
+        for (_, contributions) in self._buckets:
+            for url in contributions:
+                contributions[url] *= factor
+        self._top = [(url, score * factor) for (url, score) in self._top]
+        self._category_top = {name: [(url, score * factor) for (url, score) in top]
+                              for (name, top) in self._category_top.items()}
+
+    def _expire(self, contributions):
+        for (url, score) in contributions.items():
+            categories = self._article_categories[url]
+            self._bucket_counts[url] -= 1
+            if self._bucket_counts[url] == 0:
+                # removed instead of subtracted, so no rounding error is left
+                del self._bucket_counts[url]
+                del self._scores[url]
+                del self._article_categories[url]
+                for category in categories:
+                    scores = self._category_scores[category]
+                    del scores[url]
+                    if not scores:
+                        del self._category_scores[category]
+            else:
+                self._scores[url] -= score
+                for category in categories:
+                    self._category_scores[category][url] -= score
+        self._dirty = True
+
+    def _ensure_built(self):
+        if not self._dirty:
+            return
+        if self._built_at is not None and self.now - self._built_at < self.refresh_interval:
+            return
+        self._top = heapq.nlargest(self.top_n, self._scores.items(), key=lambda pair: pair[1])
+        self._category_top = {name: heapq.nlargest(self.top_n, scores.items(), key=lambda pair: pair[1])
+                              for (name, scores) in self._category_scores.items()}
+        self._built_at = self.now
+        self._dirty = False
+
+    def top(self, categories=None, k=None):
+        """Urls of the k most popular articles, in the union of the categories if given"""
+        k = self.top_n if k is None else min(k, self.top_n)
+        self._ensure_built()
+        if categories is None:
+            return [url for (url, _) in self._top[:k]]
+        lists = [self._category_top.get(name, []) for name in dict.fromkeys(categories)]
+        urls = []
+        seen = set()
+        for (url, _) in heapq.merge(*lists, key=lambda pair: -pair[1]):
+            if url not in seen:
+                seen.add(url)
+                urls.append(url)
+                if len(urls) == k:
+                    break
+        return urls
+
+    def most_popular(self, top_n):
+        """
+            The global and per category lists as (url, score) pairs, in the format of the
+            load function of PopularityCache, e.g. PopularityCache(engine.most_popular).
+            The scores are the decayed number of reads (or weight) at the time of the last event.
+        """
+        self._ensure_built()
+        # scores as of the last event
+        factor = math.exp(-self.decay * (self.now - self._t0)) if self.now is not None else 1.0
+        return ([(url, score * factor) for (url, score) in self._top[:top_n]],
+                {name: [(url, score * factor) for (url, score) in top[:top_n]] for (name, top) in self._category_top.items()})
+
+    def replay(self, path, files, speedup=None):
+        """
+            Add the events of the files in time order. With speedup the events are added
+            speedup times faster than they happened, e.g. 3600 replays an hour per second,
+            otherwise as fast as possible. Returns the number of events.
+        """
+        nr_of_events = 0
+        start = None
+        for f in files:
+            file_name = os.path.join(path, f)
+            if not os.path.isfile(file_name):
+                continue
+            logging.info(f"Replaying file: {file_name}")
+            events = [event for event in map(json.loads, open(file_name)) if event is not None]
+            events.sort(key=lambda event: event["time"])
+            for event in events:
+                if speedup is not None:
+                    if start is None:
+                        start = (event["time"], time.monotonic())
+                    wait = (event["time"] - start[0]) / speedup - (time.monotonic() - start[1])
+                    if wait > 0:
+                        time.sleep(wait)
+                self.add(event)
+                nr_of_events = nr_of_events + 1
+        return nr_of_events
@@ -6,34 +6,30 @@ Created on Sat Jan  5 13:48:20 2019
 @author: zhanglemei and peng
 """
 
-import json
 import os
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
 import ExplicitMF as mf
+import mf_sweep
+from event_loader import load_events
+from evaluation import hit_rate_at_k
+from interaction_matrix import InteractionMatrix
 
 from sklearn.feature_extraction.text import TfidfVectorizer
 
-from sklearn.metrics.pairwise import linear_kernel
+from content_similarity import top_k_neighbors
 
 import matplotlib.pyplot as plt
 import seaborn as sns
 sns.set()
 
 
-def load_data(path):
+def load_data(path, usecols=None, cache_dir=None):
     """
         Load events from files and convert to dataframe.
     """
-    map_lst=[]
-    for f in os.listdir(path):
-        file_name=os.path.join(path,f)
-        if os.path.isfile(file_name):
-            for line in open(file_name):
-                obj = json.loads(line.strip())
-                if not obj is None:
-                    map_lst.append(obj)
-    return pd.DataFrame(map_lst) 
+    return load_events(path, os.listdir(path), usecols=usecols, cache_dir=cache_dir, categorical=False)
 
 def statistics(df):
     """
@@ -64,61 +60,51 @@ def load_dataset(df):
         Convert dataframe to user-item-interaction matrix, which is used for 
         Matrix Factorization based recommendation.
         In rating matrix, clicked events are refered as 1 and others are refered as 0.
+        Returns a scipy.sparse CSR matrix, use InteractionMatrix directly to keep the
+        id mappings or to add more events.
     """
-    df = df[~df['documentId'].isnull()]
-    df = df.drop_duplicates(subset=['userId', 'documentId']).reset_index(drop=True)
-    df = df.sort_values(by=['userId', 'time'])
-    n_users = df['userId'].nunique()
-    n_items = df['documentId'].nunique()
-
-    ratings = np.zeros((n_users, n_items))
-    new_user = df['userId'].values[1:] != df['userId'].values[:-1]
-    new_user = np.r_[True, new_user]
-    df['uid'] = np.cumsum(new_user)
-    item_ids = df['documentId'].unique().tolist()
-    new_df = pd.DataFrame({'documentId':item_ids, 'tid':range(1,len(item_ids)+1)})
-    df = pd.merge(df, new_df, on='documentId', how='outer')
-    df_ext = df[['uid', 'tid']]
-    
-    for row in df_ext.itertuples():
-        ratings[row[1]-1, row[2]-1] = 1.0
-    return ratings
-    
+    return InteractionMatrix.from_events(df).to_csr()
+
+def load_implicit_dataset(df):
+    """
+        Convert dataframe to a sparse user-item-interaction matrix with the total activeTime
+        of each user on each document, used for implicit feedback Matrix Factorization.
+        Reads without activeTime are stored as 0, they still count as reads.
+        Users and items are numbered as in load_dataset.
+    """
+    return InteractionMatrix.from_events(df, weight='activeTime').to_csr()
+
 def train_test_split(ratings, fraction=0.2):
-    """Leave out a fraction of dataset for test use"""
-    test = np.zeros(ratings.shape)
-    train = ratings.copy()
-    for user in range(ratings.shape[0]):
-        size = int(len(ratings[user, :].nonzero()[0]) * fraction)
-        test_ratings = np.random.choice(ratings[user, :].nonzero()[0], 
-                                        size=size, 
-                                        replace=False)
-        train[user, test_ratings] = 0.
-        test[user, test_ratings] = ratings[user, test_ratings]
+    """Leave out a fraction of the stored ratings of every user for test use"""
+    dense = not sp.issparse(ratings)
+    ratings = sp.csr_matrix(ratings)
+    counts = np.diff(ratings.indptr)
+    rows = np.repeat(np.arange(ratings.shape[0]), counts)
+    # random order within each user, the first int(count * fraction) go to test
+    order = np.lexsort((np.random.random(ratings.nnz), rows))
+    position = np.arange(ratings.nnz) - ratings.indptr[rows[order]]
+    in_test = np.zeros(ratings.nnz, dtype=bool)
+    in_test[order] = position < (counts * fraction).astype(np.int64)[rows[order]]
+    train = sp.csr_matrix((ratings.data[~in_test], (rows[~in_test], ratings.indices[~in_test])), shape=ratings.shape)
+    test = sp.csr_matrix((ratings.data[in_test], (rows[in_test], ratings.indices[in_test])), shape=ratings.shape)
+    if dense:
+        return train.toarray(), test.toarray()
     return train, test
 
 def evaluate(pred, actual, k):
     """
     Evaluate recommendations according to recall@k and ARHR@k
     """
-    total_num = len(actual)
-    tp = 0.
-    arhr = 0.
-    for p, t in zip(pred, actual):
-        if t in p:
-            tp += 1.
-            arhr += 1./float(p.index(t) + 1.)
-    recall = tp / float(total_num)
-    arhr = arhr / len(actual)
+    recall, arhr = hit_rate_at_k(pred, actual, k)
     print("Recall@{} is {:.4f}".format(k, recall))
     print("ARHR@{} is {:.4f}".format(k, arhr))
     
 
-def content_processing(df):
+def content_processing(df, k=20):
     """
-        Remove events which are front page events, and calculate cosine similarities between
-        items. Here cosine similarity are only based on item category information, others such
-        as title and text can also be used.
+        Remove events which are front page events, and find the k most similar items of each
+        item by cosine similarity. Here cosine similarity are only based on item category
+        information, others such as title and text can also be used.
         Feature selection part is based on TF-IDF process.
     """
     df = df[df['documentId'].notnull()]
@@ -138,17 +124,18 @@ def content_processing(df):
     print('Dimension of feature vector: {}'.format(tfidf_matrix.shape))
     # measure similarity of two articles with cosine similarity
     
-    cosine_sim = linear_kernel(tfidf_matrix, tfidf_matrix)
+    neighbors = top_k_neighbors(tfidf_matrix, k=k)
     
-    print("Similarity Matrix:")
-    print(cosine_sim[:4, :4])
-    return cosine_sim, df
+    print("Most similar items:")
+    for item in range(min(4, len(neighbors))):
+        print(item, list(zip(neighbors.neighbors(item, 4), neighbors.similarities(item, 4))))
+    return neighbors, df
 
 def content_recommendation(df, k=20):
     """
         Generate top-k list according to cosine similarity
     """
-    cosine_sim, df = content_processing(df)
+    neighbors, df = content_processing(df, k)
     df = df[['userId','time', 'tid', 'title', 'category']]
     df.sort_values(by=['userId', 'time'], ascending=True, inplace=True)
     print(df[:20]) # see how the dataset looks like
@@ -158,11 +145,7 @@ def content_recommendation(df, k=20):
         uid, tid = row[1], row[3]
         if uid != puid and puid != None:
             idx = ptid1
-            sim_scores = list(enumerate(cosine_sim[idx]))
-            sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-            sim_scores = sim_scores[1:k+1]
-            sim_scores = [i for i,j in sim_scores]
-            pred.append(sim_scores)
+            pred.append(neighbors.neighbors(idx, k).tolist())
             actual.append(ptid2)
             puid, ptid1, ptid2 = uid, tid, tid
         else:
@@ -187,6 +170,36 @@ def collaborative_filtering(df):
     plot_learning_curve(iter_array, mf_als)
     
 
+def implicit_collaborative_filtering(df):
+    # get activeTime matrix
+    ratings = load_implicit_dataset(df)
+    # split ratings into train and test sets
+    train, test = train_test_split(ratings, fraction=0.2)
+    # train and test model with implicit matrix factorization
+    mf_als = mf.ImplicitMF(train, n_factors=40, alpha=0.01,
+                           user_reg=0.1, item_reg=0.1)
+    iter_array = [1, 2, 5, 10, 25]
+    mf_als.calculate_learning_curve(iter_array, test)
+    # plot out learning curves
+    plot_learning_curve(iter_array, mf_als)
+    
+
+def collaborative_filtering_sweep(df, results_file="mf_sweep.csv", checkpoint_dir="mf_checkpoints", seed=0):
+    # get rating matrix
+    ratings = load_dataset(df)
+    # split ratings into train and test sets, seeded so a rerun resumes from the checkpoints
+    np.random.seed(seed)
+    train, test = train_test_split(ratings, fraction=0.2)
+    # learning curves of every n_factors and regularization, in parallel
+    results = mf_sweep.sweep(train, test, n_factors=[10, 20, 40, 80], regs=[0.0, 0.01, 0.1, 1.0],
+                             iter_array=[1, 2, 5, 10, 25, 50, 100],
+                             checkpoint_dir=checkpoint_dir, results_file=results_file)
+    best = results.loc[results["test_mse"].idxmin()]
+    print("Best test mse {:.4f} with n_factors={}, reg={}, iterations={}".format(
+          best["test_mse"], best["n_factors"], best["reg"], best["iterations"]))
+    return results
+    
+
 def plot_learning_curve(iter_array, model):
     """ Plot learning curves """
     plt.plot(iter_array, model.train_mse, \
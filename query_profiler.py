@@ -0,0 +1,114 @@
+import functools
+import random
+import threading
+import time
+import pandas as pd
+
+def _db_hits(plan):
+    """Total db hits of a PROFILE plan (ResultSummary.profile) and its children"""
+    if not plan:
+        return 0
+    return plan.get("dbHits", 0) + sum(_db_hits(child) for child in plan.get("children", []))
+
+class _Result(list):
+    """The fetched records of a statement, with the Result methods the transaction functions use"""
+
+    def __init__(self, records, summary):
+        super().__init__(records)
+        self._summary = summary
+
+    def single(self):
+        return self[0] if self else None
+
+    def consume(self):
+        return self._summary
+
+class _ProfiledTransaction:
+    def __init__(self, tx, name, profiler, profile):
+        self._tx = tx
+        self._name = name
+        self._profiler = profiler
+        self._profile = profile
+        self._statement = 0
+
+    def run(self, query, parameters=None, **kwargs):
+        self._statement = self._statement + 1
+        name = self._name if self._statement == 1 else f"{self._name}#{self._statement}"
+        if self._profile:
+            query = "PROFILE " + query
+        start_time = time.perf_counter()
+        result = self._tx.run(query, parameters, **kwargs)
+        records = list(result)
+        summary = result.consume()
+        took = time.perf_counter() - start_time
+        db_hits = _db_hits(summary.profile) if self._profile else None
+        self._profiler.record(name, took, len(records), db_hits)
+        return _Result(records, summary)
+
+    def __getattr__(self, name):
+        return getattr(self._tx, name)
+
+class QueryProfiler:
+    """
+        Time, rows and (optionally) server side db hits of every statement run by the
+        transaction functions of GraphRecommendationSystem, per transaction function.
+        Statements after the first in a function are reported as name#2, name#3, ...
+
+        Params:
+            sample_rate: (float) share of the transactions that are recorded.
+            profile_rate: (float) share of the recorded transactions that run with PROFILE,
+                          which gives the db hits but makes the statements slower.
+            seed: seed of the sampling.
+    """
+
+    def __init__(self, sample_rate=1.0, profile_rate=0.0, seed=None):
+        self.sample_rate = sample_rate
+        self.profile_rate = profile_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def wrap(self, work):
+        """The transaction function work, recording its statements when it is sampled"""
+        with self._lock:
+            sampled = self._random.random() < self.sample_rate
+            profile = sampled and self._random.random() < self.profile_rate
+        if not sampled:
+            return work
+        name = work.__name__.lstrip("_")
+
+        @functools.wraps(work)
+        def profiled(tx, *args):
+            return work(_ProfiledTransaction(tx, name, self, profile), *args)
+        return profiled
+
+    def record(self, name, seconds, rows, db_hits=None):
+        with self._lock:
+            stats = self._stats.setdefault(name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "rows": 0,
+                                                  "profiled": 0, "db_hits": 0})
+            stats["calls"] += 1
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+            stats["rows"] += rows
+            if db_hits is not None:
+                stats["profiled"] += 1
+                stats["db_hits"] += db_hits
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    def report(self):
+        """
+            A dataframe with one row per query, the slowest in total first, with the calls,
+            total and mean time, rows, and the mean db hits of the profiled calls.
+        """
+        with self._lock:
+            stats = {name: dict(s) for (name, s) in self._stats.items()}
+        df = pd.DataFrame.from_dict(stats, orient="index",
+                                    columns=["calls", "seconds", "max_seconds", "rows", "profiled", "db_hits"])
+        df.index.name = "query"
+        df["mean_ms"] = 1000.0 * df["seconds"] / df["calls"]
+        df["rows_per_call"] = df["rows"] / df["calls"]
+        df["db_hits_per_call"] = df["db_hits"] / df["profiled"].where(df["profiled"] > 0)
+        return df.sort_values("seconds", ascending=False)
@@ -0,0 +1,94 @@
+import threading
+import time
+from collections import OrderedDict
+
+# dependency of the cold start entries, which change with every import
+COLD_START = object()
+
+class RecommendationCache:
+    """
+        Recommendations per (user, strategy, categories), at most max_size entries, the least
+        recently used are evicted first. Entries are dropped after ttl seconds (never if None),
+        and by invalidate(users) when the user or one of the users the entry depends on (its
+        best friends) has read something new.
+    """
+
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # user (or COLD_START) -> keys of the entries that depend on it
+        self._dependents = {}
+
+    @staticmethod
+    def key(user, strategy, categories=None):
+        return (user, strategy, None if categories is None else tuple(sorted(set(categories))))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, user, strategy, categories=None):
+        """The cached urls, or None"""
+        key = self.key(user, strategy, categories)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            (urls, _, stored_at) = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                self._remove(key)
+                self.evictions += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return urls
+
+    def put(self, user, strategy, categories, urls, depends_on=()):
+        """
+            Store the urls of the user. depends_on are the other users (e.g. the best friends)
+            whose new reads change the urls, or COLD_START for cold start recommendations.
+        """
+        key = self.key(user, strategy, categories)
+        dependencies = frozenset(depends_on) | {user}
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (urls, dependencies, time.monotonic())
+            for dependency in dependencies:
+                self._dependents.setdefault(dependency, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, users):
+        """Drop the entries of the users, and the entries that depend on them"""
+        with self._lock:
+            for user in set(users):
+                for key in list(self._dependents.get(user, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._dependents.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "invalidations": self.invalidations}
+
+    def _remove(self, key):
+        (_, dependencies, _) = self._entries.pop(key)
+        for dependency in dependencies:
+            keys = self._dependents[dependency]
+            keys.discard(key)
+            if not keys:
+                del self._dependents[dependency]
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from neo4j import AsyncGraphDatabase
+from graph_recommender_system import (FRIENDS_SUBQUERY, INDEXED_FRIENDS_SUBQUERY, MOST_POPULAR_QUERY,
+                                      MOST_POPULAR_PER_CATEGORY_QUERY, predict_batch_on_popularity_query)
+from popularity_cache import PopularityCache
+
+class RecommendationService():
+    def __init__(self, uri, user, password, best_friend_index=False, timeout=0.5, max_concurrency=200,
+                 popularity_ttl=60, top_n=20, max_connection_pool_size=100, database=None):
+        """
+        Online recommendations with the neo4j async driver, the same popularity predictions as
+        GraphRecommendationSystem.predict_on_popularity for one user per call.
+        Concurrent requests for the same user share one query. A request that does not get an
+        answer within timeout seconds, or whose query fails, gets the cold start list, which is
+        kept in memory and loaded again in the background every popularity_ttl seconds.
+        Use it as an async context manager, or call start() and close().
+
+        Params:
+            best_friend_index: (bool) use the SIMILAR_TO relationships (see build_best_friend_index).
+            timeout: (float) seconds a request waits for its query.
+            max_concurrency: (int) maximum number of queries running at the same time, the
+                             other requests wait for a free slot (which counts towards timeout).
+            popularity_ttl: (float) seconds between reloads of the cold start lists.
+            top_n: (int) length of the cold start lists, the most a cold start request gets.
+            max_connection_pool_size: (int) maximum number of connections kept by the driver.
+            database: (str) database to use, the server default if None.
+        """
+        self.driver = AsyncGraphDatabase.driver(uri, auth=(user, password),
+                                                max_connection_pool_size=max_connection_pool_size)
+        self.database = database
+        self.friends_subquery = INDEXED_FRIENDS_SUBQUERY if best_friend_index else FRIENDS_SUBQUERY
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.popularity_ttl = popularity_ttl
+        # only updated by the refresh task, so it never loads synchronously
+        self.popularity_cache = PopularityCache(None, ttl=None, top_n=top_n)
+        self.stats = {"requests": 0, "coalesced": 0, "queries": 0, "cold_starts": 0, "timeouts": 0, "errors": 0}
+        self._inflight = {}
+        self._semaphore = None
+        self._refresh_task = None
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def start(self):
+        """Load the cold start lists and start reloading them in the background"""
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        await self.refresh_popularity()
+        self._refresh_task = asyncio.ensure_future(self._refresh_popularity_loop())
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        await self.driver.close()
+
+    async def refresh_popularity(self):
+        async with self.driver.session(database=self.database) as session:
+            (top, categories) = await session.execute_read(self._most_popular, self.popularity_cache.top_n)
+        self.popularity_cache.update(top, categories)
+
+    async def _refresh_popularity_loop(self):
+        while True:
+            await asyncio.sleep(self.popularity_ttl)
+            try:
+                await self.refresh_popularity()
+            except Exception:
+                logging.exception("Reloading the cold start lists failed, keeping the old ones")
+
+    def cold_start(self, categories=None, k=20):
+        self.stats["cold_starts"] += 1
+        return self.popularity_cache.top(categories, k)
+
+    async def recommend(self, user_id, categories=None, k=20):
+        """
+            Urls of the (at most k) recommendations for the user. categories are only used
+            for the cold start list of users that do not exist.
+        """
+        self.stats["requests"] += 1
+        # the query does not depend on categories, they only choose the cold start list
+        key = (user_id, k)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._query(user_id, k))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._query_done(key, done))
+        else:
+            self.stats["coalesced"] += 1
+        try:
+            # shielded, so a timeout does not cancel the query the other requests wait for
+            (exists, urls) = await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            return self.cold_start(categories, k)
+        except Exception:
+            self.stats["errors"] += 1
+            logging.exception(f"Recommendations for user: {user_id} failed, running cold start")
+            return self.cold_start(categories, k)
+        if not exists:
+            return self.cold_start(categories, k)
+        return urls
+
+    def _query_done(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            # a query that fails after all its requests timed out is not reported otherwise
+            task.exception()
+
+    async def _query(self, user_id, k):
+        async with self._semaphore:
+            self.stats["queries"] += 1
+            async with self.driver.session(database=self.database) as session:
+                return await session.execute_read(self._predict_on_popularity, user_id, self.friends_subquery, k)
+
+    @staticmethod
+    async def _predict_on_popularity(tx, user_id, friends_subquery, limit):
+        result = await tx.run(predict_batch_on_popularity_query(friends_subquery), userIds=[user_id], limit=limit)
+        record = await result.single()
+        return record["exists"], record["urls"]
+
+    @staticmethod
+    async def _most_popular(tx, limit):
+        result = await tx.run(MOST_POPULAR_QUERY, limit=limit)
+        top = [(record["url"], record["activeTime"]) async for record in result]
+        result = await tx.run(MOST_POPULAR_PER_CATEGORY_QUERY, limit=limit)
+        return top, {record["category"]: record["top"] async for record in result}
@@ -0,0 +1,57 @@
+from abc import ABC, abstractmethod
+
+
+class RecommenderBackend(ABC):
+    """
+        Public methods shared by the recommendation engines, so the notebook can switch
+        between the Neo4j database and the in-memory engine.
+    """
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    @abstractmethod
+    def user_exists(self, user):
+        pass
+
+    @abstractmethod
+    def find_best_friends(self, user):
+        """The (at most) 10 users that have read the most of the same articles as user."""
+
+    @abstractmethod
+    def find_newest_to_friend(self, user, friend):
+        pass
+
+    @abstractmethod
+    def cold_start(self):
+        pass
+
+    @abstractmethod
+    def cold_start_with_categories(self, categories):
+        pass
+
+    @abstractmethod
+    def predict_on_popularity(self, users, categories=None):
+        """Returns a dataframe with the columns userId and url."""
+
+    @abstractmethod
+    def predict_on_bestfriends_newest(self, users):
+        """Returns a dataframe with the columns userId and url."""
+
+
+def create_backend(name, **kwargs):
+    """
+        Create a recommendation engine by name.
+        "neo4j": GraphRecommendationSystem(uri, user, password)
+        "sparse": SparseGraphRecommender(df) or SparseGraphRecommender.from_files(path, files)
+    """
+    if name == "neo4j":
+        from graph_recommender_system import GraphRecommendationSystem
+        return GraphRecommendationSystem(**kwargs)
+    if name == "sparse":
+        from sparse_graph_recommender import SparseGraphRecommender
+        if "path" in kwargs:
+            return SparseGraphRecommender.from_files(**kwargs)
+        return SparseGraphRecommender(**kwargs)
+    raise ValueError(f"Unknown backend: {name}")
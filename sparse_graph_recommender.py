@@ -0,0 +1,159 @@
+import logging
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from recommender_backend import RecommenderBackend
+from graph_recommender_system import load_data, parse_publishtime, _predictions_to_df
+
+class SparseGraphRecommender(RecommenderBackend):
+    """
+        In-memory version of GraphRecommendationSystem for offline evaluation. The read
+        relationships are kept as a sparse user x article matrix, and the graph queries are
+        answered with sparse matrix products instead of path matching.
+        The events are imported with the same defaults as the Neo4j import, so the
+        recommendations are the same. Where the Cypher queries leave the order of ties
+        undefined, ties are ordered by user id or url here.
+    """
+
+    def __init__(self, df, block_size=256):
+        self.block_size = block_size
+        df = df[~(df["title"].isnull() & (df["url"] == "http://adressa.no"))]
+        categories = df.loc[df["category"].notnull() & df["documentId"].notnull(), ["documentId", "category"]]
+        publishtime = df["publishtime"].fillna("1970-01-01T00:00:00.000Z")
+        df = pd.DataFrame({
+            "userId": df["userId"],
+            "eventId": df["eventId"],
+            "time": df["time"],
+            "activeTime": df["activeTime"].fillna(-1),
+            "title": df["title"].fillna("Unknown"),
+            "url": df["url"],
+            "publishTime": publishtime.map({p: parse_publishtime(p) for p in publishtime.unique()}),
+            "documentId": df["documentId"].fillna("Unknown"),
+        }).drop_duplicates()
+
+        # nodes: one user per userId, one article per (title, url, publishtime, documentId)
+        user_codes, self._users = pd.factorize(df["userId"], sort=True)
+        self._user_index = {user: i for (i, user) in enumerate(self._users)}
+        article_codes = df.groupby(["title", "url", "publishTime", "documentId"], sort=True).ngroup().to_numpy()
+        articles = df.assign(article=article_codes).drop_duplicates("article").sort_values("article")
+        url_codes, self._urls = pd.factorize(articles["url"], sort=True)
+        self._article_url = url_codes
+        self._article_publishtime = articles["publishTime"].to_numpy()
+        n_users, n_articles = len(self._users), len(articles)
+
+        # read relationships, grouped by user
+        order = np.lexsort((article_codes, user_codes))
+        self._read_article = article_codes[order]
+        self._read_active = df["activeTime"].to_numpy(dtype=np.float64)[order]
+        self._read_indptr = np.r_[0, np.cumsum(np.bincount(user_codes, minlength=n_users))]
+        self._reads = sp.csr_matrix((np.ones(len(order), dtype=np.int64), (user_codes[order], self._read_article)),
+                                    shape=(n_users, n_articles))
+        self._reads_t = self._reads.T.tocsr()
+        self._reads_per_user = np.diff(self._read_indptr)
+
+        # has_category relationships, every article with the documentId gets the category
+        categories = categories.assign(name=categories["category"].str.split("|")).explode("name")
+        categories = categories[["documentId", "name"]].drop_duplicates()
+        pairs = pd.merge(articles[["article", "documentId"]], categories, on="documentId")
+        category_codes, category_names = pd.factorize(pairs["name"])
+        self._category_index = {name: i for (i, name) in enumerate(category_names)}
+        self._article_categories = sp.csr_matrix((np.ones(len(pairs), dtype=bool), (pairs["article"].to_numpy(), category_codes)),
+                                                 shape=(n_articles, len(category_names)))
+
+        self._cold_start = self._top_on_active_time(np.arange(len(order)), 10)
+
+    @classmethod
+    def from_files(cls, path, files, **kwargs):
+        return cls(load_data(path, files), **kwargs)
+
+    def close(self):
+        pass
+
+    def user_exists(self, user):
+        return user in self._user_index
+
+    def _user_reads(self, u):
+        return np.arange(self._read_indptr[u], self._read_indptr[u + 1])
+
+    def _friend_reads(self, u, friends):
+        """Reads of the friends, on articles that u has not read."""
+        rows = [self._user_index[f] for f in friends if f in self._user_index]
+        if not rows:
+            return np.array([], dtype=np.int64)
+        reads = np.concatenate([self._user_reads(f) for f in rows])
+        seen = self._read_article[self._user_reads(u)]
+        return reads[~np.isin(self._read_article[reads], seen)]
+
+    def _top_on_active_time(self, reads, limit):
+        """Distinct (url, activeTime) pairs of the reads, with the highest activeTime first."""
+        urls = self._article_url[self._read_article[reads]]
+        pairs = np.unique(np.column_stack((urls, self._read_active[reads])), axis=0)
+        order = np.lexsort((pairs[:, 0], -pairs[:, 1]))[:limit]
+        return self._urls[pairs[order, 0].astype(np.int64)].tolist()
+
+    def _top_on_publishtime(self, reads, limit):
+        articles = self._read_article[reads]
+        order = np.lexsort((self._article_url[articles], -self._article_publishtime[articles]))[:limit]
+        return self._urls[self._article_url[articles[order]]].tolist()
+
+    def _best_friends(self, rows, limit=10):
+        """Best friends for a block of user indexes, computed from the co-read counts R[rows] R^T."""
+        co_reads = (self._reads[rows] @ self._reads_t).toarray()
+        # the path (u)-[r]->(a)<-[r]-(u) over the same relationship is not a match
+        co_reads[np.arange(len(rows)), rows] -= self._reads_per_user[rows]
+        n_users = co_reads.shape[1]
+        k = min(limit, n_users)
+        # most co-reads first, ties on the lowest user index
+        key = co_reads * n_users + (n_users - 1 - np.arange(n_users))
+        top = np.argpartition(-key, k - 1, axis=1)[:, :k]
+        top = np.take_along_axis(top, np.argsort(-np.take_along_axis(key, top, axis=1), axis=1), axis=1)
+        counts = np.take_along_axis(co_reads, top, axis=1)
+        return [self._users[top[i][counts[i] > 0]].tolist() for i in range(len(rows))]
+
+    def find_best_friends(self, user):
+        if user not in self._user_index:
+            return []
+        return self._best_friends(np.array([self._user_index[user]]))[0]
+
+    def _predict_for_user_on_popularity(self, user, friends):
+        if user not in self._user_index:
+            return []
+        return self._top_on_active_time(self._friend_reads(self._user_index[user], friends), 20)
+
+    def find_newest_to_friend(self, user, friend):
+        if user not in self._user_index:
+            return []
+        return self._top_on_publishtime(self._friend_reads(self._user_index[user], friend), 20)
+
+    def cold_start(self):
+        return list(self._cold_start)
+
+    def cold_start_with_categories(self, categories):
+        columns = [self._category_index[c] for c in categories if c in self._category_index]
+        in_categories = np.asarray(self._article_categories[:, columns].sum(axis=1)).ravel() > 0
+        return self._top_on_active_time(np.flatnonzero(in_categories[self._read_article]), 10)
+
+    def _predict(self, users, recommend):
+        predictions = []
+        known = [user for user in users if user in self._user_index]
+        for i in range(0, len(known), self.block_size):
+            block = known[i:i + self.block_size]
+            rows = np.array([self._user_index[user] for user in block])
+            for (user, friends) in zip(block, self._best_friends(rows)):
+                predictions.append([user, recommend(user, friends)])
+            logging.info(f"Predicted {min(i + self.block_size, len(known))}/{len(known)} users")
+        return predictions
+
+    def predict_on_popularity(self, users, categories=None):
+        predictions = {user: p for (user, p) in self._predict(users, self._predict_for_user_on_popularity)}
+        colds = None
+        for user in users:
+            if user not in predictions:
+                if colds is None:
+                    colds = self.cold_start() if categories is None else self.cold_start_with_categories(categories)
+                predictions[user] = colds
+        return _predictions_to_df([[user, predictions[user]] for user in users])
+
+    def predict_on_bestfriends_newest(self, users):
+        predictions = {user: p for (user, p) in self._predict(users, self.find_newest_to_friend)}
+        return _predictions_to_df([[user, predictions.get(user, [])] for user in users])